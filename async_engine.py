@@ -0,0 +1,327 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from base import Ready, TestResult
+from compare import CHUNK_SIZE, StreamComparator, expected_chunks
+from deadline import TimeoutExpired
+from evaluate import (free_port, ready_probes, evaluate_api_running, evaluate_pooled_service, evaluate_replay,
+                      evaluate_stub, kill_on_expiry, start_monitor, release_workspace, validate_response,
+                      request_timeout, within, stop_reason)
+from fixture import FixtureError
+from histogram import Histogram
+from load import check_performance
+from matrix import DataFileError, RowResults, iter_rows, row_variables
+from monitor import check_limits
+from ready import ReadyError, wait_ready_async
+from scenario import CaptureError, capture_values, describe_step, render_case, render_step
+from template import TemplateError
+from timing import profile
+
+
+def evaluate_request_async(request, prefix, session, timeout=None):
+    """Send the request of a test case, awaiting it yields the response once its headers arrived"""
+    # The session timeout applies when none is given
+    options = {} if timeout is None else {'timeout': aiohttp.ClientTimeout(total=timeout)}
+    return session.request(request.method, prefix + request.url, headers=request.headers,
+                           data=request.body or None, **options)
+
+
+async def validate_response_async(expected_resp, resp):
+    """Asyncio flavour of validate_response, reads the body chunk by chunk"""
+    if resp.status != expected_resp.status_code or expected_resp.body is None:
+        # Read to the end anyway, an unread body closes the keep-alive connection
+        async for _ in resp.content.iter_chunked(CHUNK_SIZE):
+            pass
+        if resp.status != expected_resp.status_code:
+            return f"status {resp.status}, expected {expected_resp.status_code}"
+        return None
+    comparator = StreamComparator(expected_chunks(expected_resp.body))
+    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+        if not comparator.feed(chunk):
+            break
+    if comparator.finish() is not None:
+        return comparator.describe()
+    return None
+
+
+async def evaluate_step_async(test_case, step, prefix, session, tracer, variables):
+    """Asyncio flavour of evaluate_step"""
+    if not step.request:
+        return None, "no request"
+    with tracer.span('request', test_case):
+        resp = await evaluate_request_async(step.request, prefix, session, request_timeout(test_case))
+    async with resp:
+        with tracer.span('validate', test_case):
+            if not step.captures:
+                if step.response_body:
+                    return resp.status, await validate_response_async(step.response, resp)
+                await resp.read()
+                return resp.status, None
+            body = await resp.read()
+            if step.response_body:
+                failure = validate_response(step.response, resp.status, [body])
+                if failure is not None:
+                    return resp.status, failure
+            variables.update(capture_values(step.captures, resp.headers, body))
+    return resp.status, None
+
+
+async def evaluate_scenario_async(test_case, variables, prefix, session, tracer):
+    """Asyncio flavour of evaluate_scenario"""
+    status_code = None
+    for number, step in enumerate(test_case.steps, 1):
+        try:
+            step = render_step(step, variables)
+            status_code, failure = await evaluate_step_async(test_case, step, prefix, session, tracer, variables)
+        except (TemplateError, CaptureError) as e:
+            failure = str(e)
+        if failure is not None:
+            if len(test_case.steps) > 1:
+                failure = f"{describe_step(number, step)}: {failure}"
+            return status_code, failure
+    return status_code, None
+
+
+async def evaluate_rows_async(test_case, prefix, session, tracer):
+    """Asyncio flavour of evaluate_rows, the rows are sent one after the other over one connection"""
+    rows = RowResults()
+    for index, row in enumerate(iter_rows(test_case)):
+        _, failure = await evaluate_scenario_async(test_case, row_variables(test_case, row), prefix, session, tracer)
+        rows.add(index, row, failure)
+    return rows
+
+
+async def evaluate_performance_async(test_case, prefix, session, tracer):
+    """Asyncio flavour of evaluate_performance, the repeated requests share the event loop"""
+    performance = test_case.performance
+    histogram = Histogram()
+    failures = {}
+    # Shared by the workers, every request is taken exactly once
+    sequence = iter(range(performance.repeat))
+
+    async def worker():
+        for _ in sequence:
+            start = time.monotonic()
+            try:
+                async with await evaluate_request_async(test_case.request, prefix, session,
+                                                        request_timeout(test_case)) as resp:
+                    if test_case.response_body:
+                        failure = await validate_response_async(test_case.response, resp)
+                    else:
+                        await resp.read()
+                        failure = None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                failure = type(e).__name__
+            histogram.record(time.monotonic() - start)
+            if failure is not None:
+                key = f"{test_case.title}: {failure}"
+                failures[key] = failures.get(key, 0) + 1
+
+    start = time.monotonic()
+    with tracer.span('repeat', test_case):
+        await asyncio.gather(*(worker() for _ in range(performance.concurrency)))
+    elapsed = time.monotonic() - start
+    return check_performance(performance, histogram, sum(failures.values()), failures, elapsed)
+
+
+async def evaluate_async(test_case, directory, prefix, context, session):
+    print(f"test_case: {test_case.title}")
+    tracer = context.tracer
+    result = TestResult(test_case)
+    if test_case.parse_error is not None:
+        result.fail(TestResult.ERROR, test_case.parse_error)
+        return result
+
+    process = None
+    monitor = None
+    cleanup_funcs = []
+    try:
+        cwd = context.workspaces.create()
+        result.workspace = cwd
+        # Replayed responses need neither fixtures nor the web.command
+        if not context.replaying:
+            with within(test_case, 'setup'):
+                if test_case.docker_compose_config:
+                    # The fixture cache blocks on its per-stack lock, so it runs off the event loop
+                    with tracer.span('fixture', test_case):
+                        await asyncio.to_thread(context.fixtures.acquire, test_case, cwd)
+
+                if test_case.config and context.services is not None:
+                    # Pooled services are SupervisedProcess objects shared with the
+                    # threaded engine, checking one out may block on readiness
+                    monitor = await asyncio.to_thread(evaluate_pooled_service, test_case, prefix, context, cleanup_funcs)
+                elif test_case.config:
+                    # The same SupervisedProcess as the threaded engine, spawning it does not block
+                    with tracer.span('start', test_case):
+                        process, _ = evaluate_api_running(test_case, cwd, context.workspaces)
+                    kill_on_expiry(test_case, process)
+                    monitor = start_monitor(process.pid, context, cleanup_funcs)
+                    ready = test_case.ready or Ready()
+                    with tracer.span('ready', test_case):
+                        await wait_ready_async(ready_probes(test_case, prefix, cwd),
+                                               timeout=test_case.deadline.remaining(ready.timeout),
+                                               interval=ready.interval, process=process)
+        prefix = evaluate_replay(test_case, directory, prefix, context, cleanup_funcs)
+
+        if test_case.request and test_case.has_rows:
+            result.request = f"{test_case.request.method} {test_case.request.url}"
+            rows = await evaluate_rows_async(test_case, prefix, session, tracer)
+            result.rows = rows.to_dict()
+            if rows.failed:
+                result.fail(TestResult.FAILED, rows.message())
+        elif test_case.has_steps:
+            result.request = f"{test_case.request.method} {test_case.request.url}" if test_case.request else ""
+            status_code, failure = await evaluate_scenario_async(test_case, dict(test_case.env.env), prefix, session,
+                                                                 tracer)
+            result.response = str(status_code)
+            if failure is not None:
+                result.fail(TestResult.FAILED, failure)
+        elif test_case.request:
+            result.request = f"{test_case.request.method} {test_case.request.url}"
+            case = render_case(test_case, dict(test_case.env.env))
+            with tracer.span('request', test_case):
+                resp = await evaluate_request_async(case.request, prefix, session, request_timeout(test_case))
+            result.response = str(resp.status)
+            async with resp:
+                with tracer.span('validate', test_case):
+                    if case.response_body:
+                        failure = await validate_response_async(case.response, resp)
+                        if failure is not None:
+                            result.fail(TestResult.FAILED, failure)
+                    else:
+                        await resp.read()
+
+            if test_case.performance is not None and result.status == TestResult.PASSED:
+                result.performance, failure = await evaluate_performance_async(case, prefix, session, tracer)
+                if failure is not None:
+                    result.fail(TestResult.FAILED, failure)
+
+        if monitor is not None:
+            # Joins the sampling thread and reads /proc a last time
+            result.resources = await asyncio.to_thread(monitor.stop)
+        # No service runs when replaying, so there is nothing to hold to the limits
+        failure = None if context.replaying else check_limits(test_case.limits, result.resources)
+        if failure is not None and result.status == TestResult.PASSED:
+            result.fail(TestResult.FAILED, failure)
+        return result
+    except (ReadyError, FixtureError, TemplateError, DataFileError, TimeoutExpired, aiohttp.ClientError,
+            asyncio.TimeoutError, OSError) as e:
+        result.fail(TestResult.ERROR, test_case.deadline.overdue() or str(e) or type(e).__name__)
+        return result
+    except asyncio.CancelledError:
+        # Cancelled by the watchdog once the deadline expired, see run_tests_async
+        if test_case.deadline.expired is None:
+            raise
+        asyncio.current_task().uncancel()
+        result.fail(TestResult.ERROR, test_case.deadline.expired)
+        return result
+    finally:
+        for cleanup in cleanup_funcs:
+            cleanup()
+        if process is not None:
+            with tracer.span('cleanup', test_case):
+                await stop_async(test_case, process)
+            if process.usage() is not None:
+                result.rusage = process.usage()
+        release_workspace(result, context.workspaces)
+
+
+async def stop_async(test_case, process):
+    """
+    Stop the web.command of a test case, waiting up to its stop timeout
+
+    The watchdog may cancel the task while the test case is already being
+    torn down. The stop is shielded so that such a late cancel cannot
+    interrupt it before the process group was killed.
+    """
+    stopping = asyncio.ensure_future(process.terminate_async())
+    try:
+        await asyncio.shield(stopping)
+    except asyncio.CancelledError:
+        await stopping
+        if test_case.deadline is None or test_case.deadline.expired is None:
+            raise
+        asyncio.current_task().uncancel()
+
+
+def cancel_threadsafe(loop, task):
+    """Cancel a task from another thread, e.g. the watchdog, unless the loop is gone"""
+    try:
+        loop.call_soon_threadsafe(task.cancel)
+    except RuntimeError:
+        pass
+
+
+async def run_tests_async(tests, directory, prefix, context, jobs, pool_size, reporter, maxfail=None):
+    """
+    Run test cases concurrently on the current event loop
+
+    Args:
+        tests (iterable): Test cases to run
+        directory (str): Directory of running test
+        prefix (str): Prefix of the api test, may reference ${PORT}
+        context (RunContext): Resources shared with the other test cases
+        jobs (int): Maximum number of test cases in flight
+        pool_size (int): Keep-alive connections kept per host
+        reporter (Reporter): Receives every TestResult as soon as it is known
+        maxfail (int): Stop starting test cases after this many failures, see stop_reason
+    """
+    ports = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    # Fixtures, pooled services and monitors are shared with the threaded
+    # engine and block, so they run in threads. Sized by jobs rather than by
+    # CPUs, with room for the calls of cancelled test cases still running
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=2 * jobs))
+    failed = 0
+    for _ in range(jobs):
+        ports.put_nowait(free_port())
+
+    connector = aiohttp.TCPConnector(limit=max(jobs, pool_size), limit_per_host=pool_size)
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def worker(test_case, port):
+            nonlocal failed
+            task = asyncio.current_task()
+            try:
+                print(f"\nExecuting test: {test_case.title}\n", end='', flush=True)
+                test_case.env.env['PORT'] = str(port)
+                test_prefix = test_case.env.render(evaluate_stub(test_case, prefix, context))
+                context.start_deadline(test_case).on_expiry(lambda: cancel_threadsafe(loop, task))
+                result = await evaluate_async(test_case, directory, test_prefix, context, session)
+            except (TemplateError, OSError) as e:
+                result = TestResult(test_case, TestResult.ERROR, str(e))
+            except asyncio.CancelledError:
+                # The deadline expired while the test case was being torn down
+                if test_case.deadline is None or test_case.deadline.expired is None:
+                    raise
+                task.uncancel()
+                result = TestResult(test_case, TestResult.ERROR, test_case.deadline.expired)
+            finally:
+                context.finish_deadline(test_case)
+                ports.put_nowait(port)
+            if not result.passed:
+                failed += 1
+            reporter.add(result)
+
+        # Holding a port bounds the number of test cases in flight, the next
+        # test case is only parsed once a port is free
+        tasks = set()
+        for test_case in tests:
+            port = await ports.get()
+            reason = stop_reason(context, failed, maxfail)
+            if reason is not None:
+                ports.put_nowait(port)
+                reporter.add(TestResult(test_case, TestResult.SKIPPED, reason))
+                continue
+            task = asyncio.create_task(worker(test_case, port))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+
+def run_tests(tests, directory, prefix, context, jobs, pool_size, reporter, maxfail=None):
+    """Entry point of the asyncio engine, blocks until every test case finished"""
+    # Test cases interleave on the event loop, which is profiled as a whole
+    with profile(context.profile_dir):
+        asyncio.run(run_tests_async(tests, directory, prefix, context, jobs, pool_size, reporter, maxfail))
@@ -1,24 +1,97 @@
+from template import render
+
+
 
 class TestRequest(object):
     def __init__(self):
         self.method = ""
         self.url = ""
-        self.headers = []
+        self.headers = {}
         self.body = ""
 
     def __str__(self):
         return f"method: {self.method}, url: {self.url}, headers: {self.headers}, body: {self.body}"
 
+class RepeatedBody(object):
+    """Expected body made of unit repeated count times, generated on demand"""
+
+    def __init__(self, unit, count):
+        self.unit = unit
+        self.count = count
+
+    def __str__(self):
+        return f'"{self.unit}" x {self.count}'
+
+    def __len__(self):
+        return len(self.unit.encode()) * self.count
+
+    def iter_chunks(self, chunk_size=65536):
+        unit = self.unit.encode()
+        if not unit or not self.count:
+            return
+        per_chunk = max(1, chunk_size // len(unit))
+        block = unit * per_chunk
+        remaining = self.count
+        while remaining >= per_chunk:
+            yield block
+            remaining -= per_chunk
+        if remaining:
+            yield unit * remaining
+
+
 class TestResponse(object):
     def __init__(self):
-        self.body = ""
+        self.body = None  # Expected body, None when only the status is checked
         self.status_code = 0
-        self.headers = []
+        self.headers = {}
     
     def __str__(self):
         return f"body: {self.body}, status_code: {self.status_code}, headers: {self.headers}"
 
 
+class StubRoute(object):
+    """A response served by the stub server for one method and path"""
+
+    def __init__(self):
+        self.method = "GET"
+        self.path = "/"
+        self.response = TestResponse()
+        self.delay = 0.0  # Seconds to wait before answering
+        self.chunk_size = None  # Send the body with chunked encoding in chunks of this size
+
+    def __str__(self):
+        return (f"method: {self.method}, path: {self.path}, response: {self.response}, delay: {self.delay}, "
+                f"chunk_size: {self.chunk_size}")
+
+
+class Capture(object):
+    """A value taken from a response, stored as a variable for the following steps"""
+
+    def __init__(self):
+        self.name = ""
+        self.header = None  # Header to read, the body if None
+        self.path = None  # JSONPath of the value in a JSON body, as a list of keys and indexes
+        self.pattern = None  # Regular expression, the value is its first group or whole match
+
+    def __str__(self):
+        return f"name: {self.name}, header: {self.header}, path: {self.path}, pattern: {self.pattern}"
+
+
+class Step(object):
+    """One request of a test case and the response it expects"""
+
+    def __init__(self):
+        self.request_source = ""  # Unparsed sections, rendered with the variables of the step
+        self.response_source = ""
+        self.request = ""
+        self.response_body = ""
+        self.response = None
+        self.captures = []
+
+    def __str__(self):
+        return f"request: {self.request}, response: {self.response}, captures: {len(self.captures)}"
+
+
 class Env(object):
     def __init__(self):
         self.env = {}
@@ -27,9 +100,7 @@ class Env(object):
         return f"env: {self.env}"
     
     def render(self, content):
-        for key, value in self.env.items():
-            content = content.replace("${%s}" % key, value)
-        return content
+        return render(content, self.env)
 
 
 class Web(object):
@@ -41,10 +112,38 @@ class Web(object):
         return f"command: {self.command}, args: {self.args}"
 
 
+class Ready(object):
+    def __init__(self):
+        self.probes = []  # (kind, target) pairs, target is rendered with the env
+        self.timeout = 30.0
+        self.interval = 0.05
+
+    def __str__(self):
+        return f"probes: {self.probes}, timeout: {self.timeout}, interval: {self.interval}"
+
+
+class Performance(object):
+    def __init__(self):
+        self.repeat = 1  # Requests sent after the functional check
+        self.concurrency = 1
+        self.max_latency = []  # (percentile, seconds) pairs
+        self.min_rps = None
+
+    def __str__(self):
+        return (f"repeat: {self.repeat}, concurrency: {self.concurrency}, max_latency: {self.max_latency}, "
+                f"min_rps: {self.min_rps}")
+
+
 class TestCase(object):
     def __init__(self):
         self.title = ""
         self.description = ""
+        self.file = None
+        self.index = 0  # Position of the block within its file
+        self.digest = None  # Hash of the lines of the block, set by the parser
+        self.parse_error = None  # Why a section could not be parsed, the test case errors without running
+        self.tags = []  # @tags of the header line
+        self.timings = {}  # Seconds spent per phase, filled in by the runner
 
         self.config = ""
         
@@ -53,6 +152,15 @@ class TestCase(object):
         self.init_sql = ""
         self.env = Env()
         self.web = None
+        self.ready = None
+        self.limits = {}  # Peak rss (bytes), fds and threads allowed for the web.command
+        self.performance = None  # Repeated requests and their budgets, see Performance
+        self.stub = []  # StubRoute list served by the stub server of the run
+        self.matrix = None  # Rows of variables, each row runs the steps once
+        self.data_file = None  # CSV or JSONL file with more rows, read while they are checked
+        self.steps = []  # Step list in file order, the first one is also request and response below
+        self.timeouts = {}  # Seconds allowed for the test, setup and each request, see TIMEOUT_PHASES
+        self.deadline = None  # Deadline of the running test case, set by the runner
 
         self.request = ""
         self.response_body = ""
@@ -60,6 +168,71 @@ class TestCase(object):
         self.error_code = None
         self.error_code_filter = False  # Flag for chomp modifier
 
+    @property
+    def has_rows(self):
+        """Whether the steps are run once per row of a matrix or data file"""
+        return self.matrix is not None or bool(self.data_file)
+
+    @property
+    def has_steps(self):
+        """Whether the test case is a scenario: several requests, or values captured from the response"""
+        return len(self.steps) > 1 or any(step.captures for step in self.steps)
+
+
+class TestResult(object):
+    PASSED = 'passed'
+    FAILED = 'failed'  # The response did not match the expectation
+    ERROR = 'error'  # The test case could not be run to the end
+    SKIPPED = 'skipped'
+
+    def __init__(self, test_case, status=PASSED, message=""):
+        self.title = test_case.title
+        self.file = test_case.file
+        self.index = test_case.index
+        self.status = status
+        self.message = message
+        self.timings = test_case.timings
+        self.request = ""  # e.g. "GET /t"
+        self.response = ""  # e.g. "200"
+        self.rusage = None  # CPU time and peak RSS of the web.command, see SupervisedProcess.usage
+        self.resources = None  # Peaks sampled while the test case ran, see Monitor.stop
+        self.performance = None  # Latency and throughput of the repeated requests
+        self.rows = None  # Outcome of the rows of a matrix or data file, see RowResults
+        self.workspace = None  # Directory of the test case, kept after the run when it failed
+
+    def __str__(self):
+        return f"title: {self.title}, status: {self.status}, message: {self.message}"
+
+    @property
+    def passed(self):
+        return self.status in (self.PASSED, self.SKIPPED)
+
+    @property
+    def duration(self):
+        return sum(self.timings.values())
+
+    def fail(self, status, message):
+        self.status = status
+        self.message = message
+
+    def to_dict(self):
+        return {
+            'title': self.title,
+            'file': self.file,
+            'index': self.index,
+            'status': self.status,
+            'message': self.message,
+            'duration': round(self.duration, 6),
+            'timings': {name: round(value, 6) for name, value in self.timings.items()},
+            'request': self.request,
+            'response': self.response,
+            'rusage': self.rusage,
+            'resources': self.resources,
+            'performance': self.performance,
+            'rows': self.rows,
+            'workspace': self.workspace,
+        }
+
 
 class TestSuite(object):
     def __init__(self):
@@ -0,0 +1,5 @@
+"""
+Benchmarks of the runner itself
+
+Run from the repository root with `python -m bench`, see bench/__main__.py.
+"""
@@ -0,0 +1,60 @@
+import json
+import platform
+import subprocess
+import sys
+import time
+import click
+from bench.cases import ROOT, bench_parse, bench_render, bench_request, bench_suite, stub_server
+
+BENCHMARKS = ('parse', 'render', 'request', 'suite')
+
+
+def metadata():
+    """What the numbers were measured on, to compare runs of different commits"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+@click.command()
+@click.option('--only', multiple=True, type=click.Choice(BENCHMARKS), help='run only these benchmarks')
+@click.option('--quick', is_flag=True, help='smaller inputs, for a fast sanity check')
+@click.option('--rounds', default=3, type=click.IntRange(min=1), help='rounds of the parse and render benchmarks, the best is reported')
+@click.option('--output', '-o', default=None, help='write the results to this file instead of stdout')
+def main(only, quick, rounds, output):
+    """Benchmark the parser, the template engine, requests and whole suite runs"""
+    selected = only or BENCHMARKS
+    results = {'meta': metadata()}
+
+    if 'parse' in selected:
+        click.echo('parse...', err=True)
+        results['parse'] = bench_parse((100, 1000) if quick else (100, 1000, 10000), rounds)
+    if 'render' in selected:
+        click.echo('render...', err=True)
+        results['render'] = bench_render((10, 100) if quick else (10, 100, 1000), 100 if quick else 1000, rounds)
+    if 'request' in selected or 'suite' in selected:
+        with stub_server() as prefix:
+            if 'request' in selected:
+                click.echo('request...', err=True)
+                results['request'] = bench_request(prefix, 200 if quick else 2000, (1, 4, 16), (5, 65536))
+            if 'suite' in selected:
+                click.echo('suite...', err=True)
+                results['suite'] = bench_suite(prefix, 40 if quick else 200, (1, 4, 16), ('thread', 'async'))
+
+    if output:
+        with open(output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import contextlib
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from base import Env, TestRequest
+from compare import CHUNK_SIZE
+from evaluate import RunContext, evaluate_request, free_port
+from histogram import Histogram
+from parser import parse_tests
+from ready import TcpProbe, wait_ready
+from report import Reporter
+from session import SessionPool
+from supervisor import SupervisedProcess
+from template import compile_template
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BLOCK = """=== TEST {index}: synthetic block {index} @bench
+Block {index} of a synthetic corpus
+--- env
+NAME = "block-{index}"
+GREETING = "hello, ${{NAME}}"
+--- config
+location = /t/{index} {{
+    echo "${{GREETING}}";
+}}
+--- web
+command = api-server --port ${{PORT}}
+--- ready
+http /t/{index}
+timeout 5s
+--- request
+POST /t/{index}?page={index}
+Content-Type: application/json
+X-Block: {index}
+
+{{"index": {index}, "name": "block-{index}"}}
+--- response_body
+status 200
+content-type: application/json
+body {{"index": {index}}}
+
+"""
+
+
+def timed(func, rounds):
+    """Seconds taken by every one of `rounds` calls of func"""
+    durations = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def synthetic_corpus(blocks):
+    return ''.join(BLOCK.format(index=index) for index in range(blocks))
+
+
+def bench_parse(sizes, rounds):
+    """Parse synthetic .t corpora of increasing size with parser.parse_tests"""
+    results = []
+    for size in sizes:
+        corpus = synthetic_corpus(size)
+        lines = corpus.split('\n')
+        durations = timed(lambda: sum(1 for _ in parse_tests(lines)), rounds)
+        best = min(durations)
+        results.append({
+            'blocks': size,
+            'bytes': len(corpus),
+            'best_s': round(best, 6),
+            'median_s': round(statistics.median(durations), 6),
+            'blocks_per_s': round(size / best, 1),
+            'mb_per_s': round(len(corpus) / best / (1 << 20), 2),
+        })
+    return results
+
+
+def bench_render(variable_counts, placeholders, rounds, renders=1000):
+    """Render a large template referencing many variables with Env.render, cold and compiled"""
+    results = []
+    for count in variable_counts:
+        env = Env()
+        env.env = {f"VAR_{index}": f"value-{index}" for index in range(count)}
+        template = '\n'.join(f"key_{index} = ${{VAR_{index % count}}} ${{MISSING_{index}:-default}}"
+                             for index in range(placeholders))
+
+        def cold():
+            compile_template.cache_clear()
+            env.render(template)
+
+        def warm():
+            for _ in range(renders):
+                env.render(template)
+
+        cold_durations = timed(cold, rounds)
+        env.render(template)
+        warm_best = min(timed(warm, rounds))
+        results.append({
+            'variables': count,
+            'placeholders': placeholders * 2,
+            'template_bytes': len(template),
+            'cold_ms': round(min(cold_durations) * 1000, 3),
+            'renders_per_s': round(renders / warm_best, 1),
+        })
+    return results
+
+
+@contextlib.contextmanager
+def stub_server():
+    """Run the bundled stub HTTP server, bench/server.py, for the duration of the block"""
+    port = free_port()
+    process = SupervisedProcess(sys.executable, ['-m', 'bench.server', str(port)], ROOT)
+    process.run()
+    try:
+        wait_ready([TcpProbe('127.0.0.1', port)], timeout=10.0, process=process)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+
+
+def bench_request(prefix, count, concurrency_levels, body_sizes):
+    """Send requests with evaluate_request over pooled sessions from several threads"""
+    results = []
+    for size in body_sizes:
+        request = TestRequest()
+        request.method = 'GET'
+        request.url = f"/size/{size}"
+        for concurrency in concurrency_levels:
+            sessions = SessionPool(concurrency)
+            histograms = []
+            per_thread = max(1, count // concurrency)
+
+            def worker():
+                histogram = Histogram()
+                histograms.append(histogram)
+                session = sessions.get()
+                for _ in range(per_thread):
+                    start = time.perf_counter()
+                    resp = evaluate_request(request, prefix, None, session)
+                    with resp:
+                        for _ in resp.iter_content(CHUNK_SIZE):
+                            pass
+                    histogram.record(time.perf_counter() - start)
+
+            threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            sessions.close()
+
+            histogram = Histogram()
+            for other in histograms:
+                histogram.merge(other)
+            results.append({
+                'body_bytes': size,
+                'concurrency': concurrency,
+                'requests': histogram.count,
+                'seconds': round(elapsed, 3),
+                'requests_per_s': round(histogram.count / elapsed, 1),
+                'latency_ms': histogram.summary(),
+            })
+    return results
+
+
+class CountingReporter(Reporter):
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, result):
+        self.counts[result.status] = self.counts.get(result.status, 0) + 1
+
+
+def write_suite(directory, tests, per_file=10):
+    """A suite of test cases sending GET /t to the stub server"""
+    test_dir = os.path.join(directory, 't')
+    os.makedirs(test_dir, exist_ok=True)
+    for first in range(0, tests, per_file):
+        blocks = [f"=== TEST {index}: hello {index}\n--- request\nGET /t\n--- response_body\nstatus 200\nbody hello\n"
+                  for index in range(first, min(first + per_file, tests))]
+        with open(os.path.join(test_dir, f"suite_{first // per_file}.t"), 'w') as fp:
+            fp.write('\n'.join(blocks))
+
+
+def bench_suite(prefix, tests, jobs_levels, engines):
+    """Wall time of a whole suite run by main at several parallelism levels"""
+    import main
+
+    directory = tempfile.mkdtemp(prefix='api-test-bench-')
+    results = []
+    try:
+        write_suite(directory, tests)
+        for engine in engines:
+            for jobs in jobs_levels:
+                context = RunContext(sessions=SessionPool(), monitor_interval=None)
+                reporter = CountingReporter()
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    start = time.perf_counter()
+                    tests_iter = main.iter_tests(main.scan_test_files(directory))
+                    if engine == 'async':
+                        import async_engine
+                        async_engine.run_tests(tests_iter, directory, prefix, context, jobs, 10, reporter)
+                    else:
+                        main.run_tests(tests_iter, directory, prefix, context, jobs, reporter)
+                    elapsed = time.perf_counter() - start
+                context.close()
+                results.append({
+                    'engine': engine,
+                    'jobs': jobs,
+                    'tests': tests,
+                    'seconds': round(elapsed, 3),
+                    'tests_per_s': round(tests / elapsed, 1),
+                    'results': reporter.counts,
+                })
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
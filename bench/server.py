@@ -0,0 +1,29 @@
+import sys
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers every GET with a body of the size given by the path, e.g. /size/1024"""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, which Nagle's algorithm would
+    # hold back until the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        size = int(self.path.rsplit('/', 1)[-1]) if self.path.startswith('/size/') else 5
+        body = b'a' * size if self.path.startswith('/size/') else b'hello'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(('127.0.0.1', int(sys.argv[1])), Handler)
+    server.daemon_threads = True
+    print('listening', flush=True)
+    server.serve_forever()
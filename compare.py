@@ -0,0 +1,86 @@
+from base import RepeatedBody
+
+
+CHUNK_SIZE = 65536
+EXCERPT_SIZE = 32
+
+
+def expected_chunks(body, chunk_size=CHUNK_SIZE):
+    """Yield the expected body as encoded chunks"""
+    if isinstance(body, RepeatedBody):
+        yield from body.iter_chunks(chunk_size)
+        return
+    content = body.encode()
+    for start in range(0, len(content), chunk_size):
+        yield content[start:start + chunk_size]
+
+
+class StreamComparator(object):
+    """
+    Compare a body arriving in chunks with a lazily generated expected body
+
+    Neither body is held in memory, only the current chunk of each side.
+    """
+
+    def __init__(self, expected):
+        self.expected = iter(expected)
+        self.pending = memoryview(b'')
+        self.offset = 0
+        self.mismatch = None
+        # Bytes of each side starting at the mismatch, for the failure message
+        self.expected_excerpt = b''
+        self.actual_excerpt = b''
+
+    def next_expected(self):
+        for chunk in self.expected:
+            if chunk:
+                return memoryview(chunk)
+        return None
+
+    def feed(self, chunk):
+        """
+        Compare the next chunk of the actual body
+
+        Returns:
+            bool: False once a mismatch was found, further chunks are ignored
+        """
+        if self.mismatch is not None:
+            return False
+        chunk = memoryview(chunk)
+        while chunk:
+            if not self.pending:
+                self.pending = self.next_expected()
+                if self.pending is None:
+                    # Actual body is longer than the expected one
+                    self.mismatch = self.offset
+                    self.actual_excerpt = bytes(chunk[:EXCERPT_SIZE])
+                    return False
+            size = min(len(chunk), len(self.pending))
+            if chunk[:size] != self.pending[:size]:
+                index = next(i for i in range(size) if chunk[i] != self.pending[i])
+                self.mismatch = self.offset + index
+                self.expected_excerpt = bytes(self.pending[index:index + EXCERPT_SIZE])
+                self.actual_excerpt = bytes(chunk[index:index + EXCERPT_SIZE])
+                return False
+            self.offset += size
+            chunk = chunk[size:]
+            self.pending = self.pending[size:]
+        return True
+
+    def finish(self):
+        """
+        Returns:
+            int: Offset of the first differing byte, None if the bodies are equal
+        """
+        if self.mismatch is None:
+            if not self.pending:
+                self.pending = self.next_expected()
+            if self.pending:
+                # Expected body is longer than the actual one
+                self.mismatch = self.offset
+                self.expected_excerpt = bytes(self.pending[:EXCERPT_SIZE])
+        return self.mismatch
+
+    def describe(self):
+        """Failure message of a mismatch found by finish()"""
+        return f"body differs at byte {self.mismatch}: expected {self.expected_excerpt!r}, got {self.actual_excerpt!r}"
@@ -0,0 +1,166 @@
+import contextlib
+import threading
+import time
+
+
+class TimeoutExpired(Exception):
+    pass
+
+
+def format_seconds(seconds):
+    return f"{seconds:.3g}s"
+
+
+class Deadline(object):
+    """
+    Time limits of a running test case, or of the whole run
+
+    A deadline has an overall timeout and optionally one per phase, which
+    applies while the code runs within(phase). Blocking calls bound
+    themselves with remaining(). Once a limit is reached the Watchdog calls
+    expire(), which runs the registered callbacks, e.g. killing the
+    processes of the test case so that whatever waits on them returns.
+    """
+
+    def __init__(self, timeout=None, phase_timeouts=None, request_timeout=None, label='test case'):
+        self.timeout = timeout
+        self.phase_timeouts = phase_timeouts or {}
+        self.request_timeout = request_timeout  # Seconds a single request may take
+        self.label = label
+        self.started = time.monotonic()
+        self.phase = None
+        self.phase_started = None
+        self.expired = None  # Why the deadline expired, once it did
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    @property
+    def limited(self):
+        """Whether the deadline can expire by itself"""
+        return self.timeout is not None or any(timeout is not None for timeout in self.phase_timeouts.values())
+
+    def limit(self):
+        """
+        Returns:
+            tuple: (monotonic time, description) of the nearest limit, None without limits
+        """
+        limits = []
+        if self.timeout is not None:
+            limits.append((self.started + self.timeout, f"{self.label} timed out after {format_seconds(self.timeout)}"))
+        phase, phase_started = self.phase, self.phase_started
+        phase_timeout = self.phase_timeouts.get(phase)
+        if phase_timeout is not None:
+            limits.append((phase_started + phase_timeout, f"{phase} timed out after {format_seconds(phase_timeout)}"))
+        return min(limits) if limits else None
+
+    @contextlib.contextmanager
+    def within(self, phase):
+        """Apply the timeout of a phase to the enclosed block"""
+        self.check()
+        self.phase_started = time.monotonic()
+        self.phase = phase
+        try:
+            yield
+        finally:
+            # A wait bounded by remaining() may end before the watchdog noticed
+            self.overdue()
+            self.phase = None
+        self.check()
+
+    def remaining(self, cap=None):
+        """
+        Seconds left before the nearest limit
+
+        Args:
+            cap (float): Upper bound, e.g. the timeout of the blocking call
+
+        Returns:
+            float: At most cap, None when there is neither a limit nor a cap
+        """
+        self.check()
+        limit = self.limit()
+        if limit is None:
+            return cap
+        # Zero means no timeout to some libraries
+        left = max(0.001, limit[0] - time.monotonic())
+        return left if cap is None else min(cap, left)
+
+    def overdue(self):
+        """
+        Why the deadline expired, also when it is past its limit but the watchdog did not notice yet
+
+        Returns:
+            str: Reason, None while the deadline did not expire
+        """
+        limit = self.limit()
+        if self.expired is None and limit is not None and time.monotonic() >= limit[0]:
+            self.expire(limit[1])
+        return self.expired
+
+    def check(self):
+        if self.expired is not None:
+            raise TimeoutExpired(self.expired)
+
+    def on_expiry(self, callback):
+        """Call callback when the deadline expires, right away if it already did"""
+        with self.lock:
+            if self.expired is None:
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def expire(self, reason):
+        with self.lock:
+            if self.expired is not None:
+                return
+            self.expired = reason
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class Watchdog(object):
+    """Expires the deadlines of the running test cases from a background thread"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.deadlines = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def watch(self, deadline):
+        """Track a deadline until it expires or is unwatched, also when it only expires with the run"""
+        with self.lock:
+            self.deadlines.add(deadline)
+            if self.thread is None and deadline.limited:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def unwatch(self, deadline):
+        with self.lock:
+            self.deadlines.discard(deadline)
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            now = time.monotonic()
+            with self.lock:
+                deadlines = list(self.deadlines)
+            for deadline in deadlines:
+                limit = deadline.limit()
+                if limit is not None and now >= limit[0]:
+                    self.unwatch(deadline)
+                    deadline.expire(limit[1])
+
+    def expire_all(self, reason):
+        """Expire every watched deadline, e.g. when the budget of the run is spent"""
+        with self.lock:
+            deadlines = list(self.deadlines)
+            self.deadlines.clear()
+        for deadline in deadlines:
+            deadline.expire(reason)
+
+    def close(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,139 @@
+import fnmatch
+import os
+import zlib
+from parser import parse_header
+
+
+class IndexEntry(object):
+    """A test block known from its header line only"""
+
+    def __init__(self, file, index, title, tags):
+        self.file = file
+        self.relpath = None  # Path relative to the test root, set by discover
+        self.index = index
+        self.title = title
+        self.tags = tags
+
+    def __str__(self):
+        return f"file: {self.file}, index: {self.index}, title: {self.title}, tags: {self.tags}"
+
+
+def matches(path, patterns):
+    """Whether a relative path, or its file name, matches one of the glob patterns"""
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def walk_test_files(root, include=('*.t',), exclude=()):
+    """
+    Test files below root, in a stable order
+
+    Args:
+        root (str): Directory to walk recursively
+        include (tuple): Glob patterns a file must match, on its relative path or name
+        exclude (tuple): Glob patterns of files and directories to leave out
+
+    Returns:
+        list: (path, relative path) pairs sorted by relative path
+    """
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        reldir = os.path.relpath(dirpath, root)
+        reldir = '' if reldir == '.' else reldir
+        # Pruning excluded directories keeps the walk from descending into them
+        dirnames[:] = sorted(name for name in dirnames
+                             if not name.startswith('.') and not matches(os.path.join(reldir, name), exclude))
+        for name in filenames:
+            relpath = os.path.join(reldir, name)
+            if matches(relpath, include) and not matches(relpath, exclude):
+                files.append((os.path.join(dirpath, name), relpath))
+    files.sort(key=lambda item: item[1])
+    return files
+
+
+def index_file(file_path):
+    """
+    Index the test blocks of a file from their header lines, without parsing them
+
+    Counts blocks the way parser.parse_tests does, including the untitled
+    block of sections appearing before the first header.
+
+    Yields:
+        IndexEntry: One entry per test block
+    """
+    index = 0
+    seen_block = False
+    with open(file_path, 'r') as fp:
+        for line in fp:
+            if line.startswith('=== TEST'):
+                title, tags = parse_header(line.rstrip('\r\n'))
+                yield IndexEntry(file_path, index, title, tags)
+                index += 1
+                seen_block = True
+            elif line.startswith('--- ') and not seen_block:
+                yield IndexEntry(file_path, index, '', [])
+                index += 1
+                seen_block = True
+
+
+def keyword_matches(entry, keyword):
+    """A keyword matches a tag (@tag or tag) or a part of the title, ignoring case"""
+    keyword = keyword.lower()
+    if keyword.startswith('@'):
+        return keyword[1:] in (tag.lower() for tag in entry.tags)
+    return keyword in (tag.lower() for tag in entry.tags) or keyword in entry.title.lower()
+
+
+def selected(entry, keywords):
+    """
+    Whether an entry is selected by the -k keywords
+
+    An entry is selected when it matches any of the keywords, or there are
+    only negated ones, and matches none of the keywords negated with "!".
+    """
+    wanted = [keyword for keyword in keywords if not keyword.startswith('!')]
+    unwanted = [keyword[1:] for keyword in keywords if keyword.startswith('!')]
+    if wanted and not any(keyword_matches(entry, keyword) for keyword in wanted):
+        return False
+    return not any(keyword_matches(entry, keyword) for keyword in unwanted)
+
+
+def shard_of(entry, count):
+    """
+    Shard of an entry, 0 based
+
+    The hash covers the relative path and the title, so every machine of a
+    CI job puts a test case in the same shard whatever the checkout path
+    and the order of the blocks.
+    """
+    return zlib.crc32(f"{entry.relpath}\0{entry.title}".encode()) % count
+
+
+def discover(root, include=('*.t',), exclude=(), keywords=(), shard=None):
+    """
+    Select the test blocks to run
+
+    Args:
+        root (str): Directory holding the test files
+        include (tuple): Glob patterns of test files
+        exclude (tuple): Glob patterns of test files and directories to leave out
+        keywords (tuple): -k keywords, see selected
+        shard (tuple): (index, count), 0 based, to keep one shard only
+
+    Returns:
+        tuple: (files, total), files maps every file with a selected block to
+               the set of selected block indexes, in discovery order; total
+               is the number of blocks found
+    """
+    files = {}
+    total = 0
+    for file_path, relpath in walk_test_files(root, include, exclude):
+        for entry in index_file(file_path):
+            total += 1
+            entry.relpath = relpath
+            if not selected(entry, keywords):
+                continue
+            if shard is not None and shard_of(entry, shard[1]) != shard[0]:
+                continue
+            files.setdefault(file_path, set()).add(entry.index)
+    return files, total
@@ -1,57 +1,112 @@
-import random
-import string
+import contextlib
 import glob
 import os
+import signal
+import socket
 import subprocess
+import threading
 import requests
-import shutil
-from base import TestCase, TestSuite
-from parser import parse_test
-
-
-def generate_folder_name():
-    random_str = ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(10))
-    return f"test_{random_str}"
-
-class ControlledProcess(object):
-
-    def __init__(self, command, args, cwd):
-        self.command = command
-        self.args = args
-        self.cwd = cwd
-        self.child_pid = None
-
-    def run(self):
-        # Fork a child process
-        pid = os.fork()
-        if pid == 0:
-            # In child process
-            os.chdir(self.cwd)
-            command = shutil.which(self.command)
-            print('----', command, self.args)
-            os.execv(command, [command] + self.args)
-        else:
-            # In parent process, store child pid
-            self.child_pid = pid
-            return pid
-
-    def terminate(self):
-        """Kill the child process"""
-        if hasattr(self, 'child_pid'):
-            try:
-                os.kill(self.child_pid, 9)  # SIGKILL
-            except OSError:
-                # Process may already be dead
-                pass
-
-    def join(self):
-        if hasattr(self, 'child_pid'):
-            os.waitpid(self.child_pid, 0)
-
-    def is_alive(self):
-        return os.path.exists(f"/proc/{self.child_pid}")
-
-
+from base import TestCase, TestSuite, TestResult, Ready
+from compare import CHUNK_SIZE, StreamComparator, expected_chunks
+from deadline import Deadline, TimeoutExpired, Watchdog
+from parser import parse_tests
+from supervisor import SupervisedProcess
+from fixture import FixtureCache, FixtureError
+from matrix import DataFileError, RowResults, iter_rows, row_variables
+from scenario import CaptureError, capture_values, describe_step, render_case, render_step, step_case
+from session import SessionPool
+from monitor import Monitor, check_limits
+from ready import ReadyError, build_probe, default_probe, wait_ready
+from template import TemplateError
+from timing import Tracer, profile
+from workspace import Workspaces
+
+
+class RunContext(object):
+    """Resources shared by every test case of a run"""
+
+    def __init__(self, fixtures=None, sessions=None, tracer=None, profile_dir=None, services=None, monitor_interval=0.1,
+                 workspaces=None, timeouts=None, run_timeout=None, replay_store=None):
+        self.workspaces = workspaces if workspaces is not None else Workspaces()
+        self.fixtures = fixtures if fixtures is not None else FixtureCache(self.workspaces)
+        self.sessions = sessions if sessions is not None else SessionPool()
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.profile_dir = profile_dir  # cProfile dumps per test case when set
+        self.services = services  # ServicePool when web.command processes are reused
+        self.monitor_interval = monitor_interval  # Seconds between resource samples, 0 or None disables them
+        self.stub = None
+        self.replay_store = replay_store  # ReplayStore when upstream responses are recorded or replayed
+        self.replay = None
+        self.lock = threading.Lock()
+        self.timeouts = timeouts or {}  # Default seconds per phase, overridden by the timeout sections
+        self.watchdog = Watchdog()
+        self.run_deadline = Deadline(run_timeout, label='run')
+        if run_timeout is not None:
+            self.run_deadline.on_expiry(lambda: self.watchdog.expire_all(f"cancelled, {self.run_deadline.expired}"))
+            self.watchdog.watch(self.run_deadline)
+
+    def start_deadline(self, test_case):
+        """
+        Start the deadline of a test case, the timeout section overrides the timeouts of the run
+
+        Returns:
+            Deadline: Also set as test_case.deadline until finish_deadline
+        """
+        timeouts = dict(self.timeouts, **test_case.timeouts)
+        deadline = Deadline(timeouts.get('test'), {'setup': timeouts.get('setup')}, timeouts.get('request'))
+        test_case.deadline = deadline
+        self.watchdog.watch(deadline)
+        if self.run_deadline.expired is not None:
+            deadline.expire(f"cancelled, {self.run_deadline.expired}")
+        return deadline
+
+    def finish_deadline(self, test_case):
+        if test_case.deadline is not None:
+            self.watchdog.unwatch(test_case.deadline)
+
+    def stub_server(self):
+        """The stub server of the run, started by the first test case declaring a stub"""
+        with self.lock:
+            if self.stub is None:
+                # aiohttp is only needed by test cases with a stub section
+                from stub import StubServer
+                self.stub = StubServer().start()
+            return self.stub
+
+    @property
+    def replaying(self):
+        """Whether responses come from the replay store, so fixtures and services are not started"""
+        return self.replay_store is not None and not self.replay_store.recording
+
+    def replay_server(self):
+        """The replay server of the run, started by the first test case when recording or replaying"""
+        with self.lock:
+            if self.replay is None:
+                from replay import ReplayServer
+                self.replay = ReplayServer(self.replay_store).start()
+            return self.replay
+
+    def close(self):
+        self.watchdog.close()
+        self.sessions.close()
+        if self.stub is not None:
+            self.stub.close()
+        if self.replay is not None:
+            self.replay.close()
+        if self.replay_store is not None:
+            self.replay_store.close()
+        if self.services is not None:
+            self.services.close()
+        self.fixtures.close()
+        # Last, services and fixtures live in workspaces
+        self.workspaces.close()
+
+
+def free_port():
+    """Ask the kernel for a currently unused TCP port on the loopback interface"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
 
 # class BackgroundProcess(object):
 #     def __init__(self, command, args, cwd, close_func=None):
@@ -88,70 +143,74 @@ class ControlledProcess(object):
 #     def is_alive(self):
 #         return self.thread.is_alive()
     
-def evaluate_docker_compose_up(test_case, cwd):
-
-    with open('./my.cnf', 'w') as fp:
-        fp.write(test_case.env.render(test_case.mysql_config))
-
-    with open('./init.sql', 'w') as fp:
-        fp.write(test_case.env.render(test_case.init_sql))
-
-    with open('./init-database.sh', 'w') as fp:
-        fp.write(test_case.env.render('''#!/usr/bin/env bash
-mysql -u ${MYSQL_USER} -p${MYSQL_PASSWORD} ${MYSQL_DATABASE} < "/docker-entrypoint-initdb.d/init.sql"'''))
-        
-    with open('./docker-compose.yaml', 'w') as fp:
-        fp.write(test_case.env.render(test_case.docker_compose_config))
+def evaluate_stub(test_case, prefix, context):
+    """
+    Serve the stub routes of a test case and expose their URL as ${STUB_URL}
+
+    Returns:
+        str: Prefix to send the request to, the stub itself for a test case without a web.command
+    """
+    if not test_case.stub:
+        return prefix
+    url = context.stub_server().register(test_case.stub)
+    test_case.env.env['STUB_URL'] = url
+    return prefix if test_case.config else url
+
+def evaluate_replay(test_case, directory, prefix, context, cleanup_funcs):
+    """
+    Send the requests of a test case through the replay server when recording or replaying
+
+    Returns:
+        str: Prefix to send the requests to
+    """
+    if context.replay_store is None:
+        return prefix
+    from replay import replay_id
+    server = context.replay_server()
+    url = server.attach(replay_id(test_case, directory), prefix)
+    cleanup_funcs.append(lambda: server.detach(url))
+    return url
+
+def evaluate_docker_compose_up(test_case, cwd, fixtures):
+    """Bring up (or reuse) the docker compose stack of a test case"""
+    return fixtures.acquire(test_case, cwd)
+
+
+def evaluate_request(request, prefix, cwd, session=None, timeout=None):
+    """Send the request of a test case, over the pooled session if one is given"""
+    real_url = prefix + request.url
+    client = session if session is not None else requests
+    # The body is streamed, the caller reads or closes the response
+    return client.request(request.method, real_url, headers=request.headers, data=request.body or None,
+                          stream=True, timeout=timeout)
 
-    process = ControlledProcess('docker', ['compose', 'up'], cwd)
-    process.run()
 
-    # 需要等待进程完全启动后返回
+def request_timeout(test_case):
+    """Seconds the next request of a test case may take, None without a limit"""
+    deadline = test_case.deadline
+    return deadline.remaining(deadline.request_timeout) if deadline is not None else None
 
-    with open('./mysql-wait-until.sh', 'w') as fp:
-        fp.write('''
-while ! mysqladmin ping -h"127.0.0.1" --silent; do
-    sleep 1
-done
-''')
 
-    process2 = ControlledProcess('bash', ['./mysql-wait-until.sh'], cwd)
-    process2.run()
-    process2.join()
+def within(test_case, phase):
+    """Apply the timeout of a phase of a test case, if it runs with a deadline"""
+    return test_case.deadline.within(phase) if test_case.deadline is not None else contextlib.nullcontext()
 
-    ControlledProcess('docker-compose', ['exec', 'db', 'bash', '-c', "./docker-entrypoint-initdb.d/init-database.sh"], cwd).run()
 
-    def cleanup():
-        ControlledProcess('docker', ['compose', 'down'], cwd).run()
-        process.terminate()
-        process2.terminate()
-
-    return process, cleanup
+def kill_on_expiry(test_case, process):
+    """Kill the process group of a test case's web.command when its deadline expires, unblocking the test"""
+    if test_case.deadline is not None:
+        test_case.deadline.on_expiry(lambda: process.signal_group(signal.SIGKILL))
 
 
-def evaluate_request(request, prefix, cwd):
-    real_url = prefix + request.url
-    if request.method == 'GET': 
-        resp = requests.get(real_url)
-    elif request.method == 'POST':
-        resp = requests.post(real_url, headers=request.headers, data=request.body)
-    elif request.method == 'PUT':
-        resp = requests.put(real_url, headers=request.headers, data=request.body)
-    elif request.method == 'DELETE':
-        resp = requests.delete(real_url)
-    return resp
-
-def evaluate_api_running(test_case, cwd):
-    api_config = test_case.config
-    with open('./api.yaml', 'w') as fp:
-        fp.write(api_config)
+def evaluate_api_running(test_case, cwd, workspaces):
+    workspaces.write(cwd, 'api.yaml', test_case.env.render(test_case.config))
 
     web = test_case.web
 
     command = test_case.env.render(web.command)
     args = [test_case.env.render(arg) for arg in web.args]
 
-    process = ControlledProcess(command, args, cwd)
+    process = SupervisedProcess(command, args, cwd, log_path=os.path.join(cwd, 'web.log'))
     process.run()
 
     def cleanup():
@@ -160,25 +219,106 @@ def evaluate_api_running(test_case, cwd):
     return process, cleanup
 
 
+def ready_probes(test_case, prefix, cwd):
+    """Probes declared by the ready section, or a TCP probe on the prefix"""
+    ready = test_case.ready or Ready()
+    if ready.probes:
+        return [build_probe(kind, test_case.env.render(target), prefix, cwd) for kind, target in ready.probes]
+    return [default_probe(prefix)]
+
+
+def evaluate_ready(test_case, prefix, cwd, process):
+    """Block until the web.command of a test case accepts requests"""
+    ready = test_case.ready or Ready()
+    probes = ready_probes(test_case, prefix, cwd)
+    timeout = test_case.deadline.remaining(ready.timeout) if test_case.deadline is not None else ready.timeout
+    return wait_ready(probes, timeout=timeout, interval=ready.interval, process=process)
+
+
+def start_monitor(pid, context, cleanup_funcs):
+    """
+    Sample the process tree of a started web.command until the test case ends
+
+    Returns:
+        Monitor: Running monitor, None when monitoring is disabled
+    """
+    if not context.monitor_interval:
+        return None
+    monitor = Monitor(pid, context.monitor_interval).start()
+    cleanup_funcs.append(monitor.stop)
+    return monitor
+
+
+def evaluate_pooled_service(test_case, prefix, context, cleanup_funcs):
+    """
+    Check out the warm service of a test case from the pool and wait for it if it was (re)started
+
+    Returns:
+        Monitor: Monitor of the service, see start_monitor
+    """
+    with context.tracer.span('start', test_case):
+        service, state = context.services.checkout(test_case)
+    kill_on_expiry(test_case, service.process)
+    monitor = start_monitor(service.process.pid, context, cleanup_funcs)
+    if state != context.services.REUSED:
+        with context.tracer.span('ready', test_case):
+            try:
+                evaluate_ready(test_case, prefix, service.cwd, service.process)
+            except ReadyError:
+                context.services.discard(service)
+                raise
+    return monitor
+
+
+def validate_response(expected_resp, status_code, chunks):
+    """
+    Compare status code and body of a response with the expectation
+
+    Args:
+        expected_resp (TestResponse): Expected response
+        status_code (int): Status code of the response
+        chunks (iterable): Body of the response as bytes chunks, read lazily
+
+    Returns:
+        str: Description of the first difference, None if the response matched
+    """
+    if status_code != expected_resp.status_code or expected_resp.body is None:
+        # Read to the end anyway, an unread body closes the keep-alive connection
+        for _ in chunks:
+            pass
+        if status_code != expected_resp.status_code:
+            return f"status {status_code}, expected {expected_resp.status_code}"
+        return None
+    comparator = StreamComparator(expected_chunks(expected_resp.body))
+    for chunk in chunks:
+        if not comparator.feed(chunk):
+            break
+    if comparator.finish() is not None:
+        return comparator.describe()
+    return None
+
+
 def evaluate_api_down(api_config):
     subprocess.run(['api-service', 'down'])
 
 
-def evaluate(test_case, directory, prefix):
-    print(f"test_case: {test_case.title}")
-    processes = []
-
-    folder_name = generate_folder_name()
-    os.makedirs(folder_name, exist_ok=True)
-    os.chdir(folder_name)
+def evaluate_setup(test_case, prefix, cwd, context, processes, cleanup_funcs):
+    """
+    Start the docker compose stack and service of a test case and wait for them
 
-    cwd = os.getcwd()
+    Started processes and their cleanup functions are appended to the given
+    lists as soon as they exist, so the caller can tear them down even when
+    a later step raises.
 
-    cleanup_funcs = []
+    Returns:
+        Monitor: Resource monitor of the web.command, None if there is none
+    """
+    monitor = None
     if test_case.docker_compose_config:
-        docker_compose_process, cleanup = evaluate_docker_compose_up(test_case, cwd)
-        processes.append(docker_compose_process)
-        cleanup_funcs.append(cleanup)
+        # The stack is shared with other test cases and torn down by the
+        # context at the end of the run
+        with context.tracer.span('fixture', test_case):
+            evaluate_docker_compose_up(test_case, cwd, context.fixtures)
 
         # Wait for docker-compose to start up
         # docker_compose_thread.join()
@@ -190,21 +330,188 @@ def evaluate(test_case, directory, prefix):
         # subprocess.run(['docker-compose', 'down'])
  
         # return result
-    if test_case.config:
-        api_running_process, cleanup = evaluate_api_running(test_case, cwd)
+    if test_case.config and context.services is not None:
+        # The service stays in the pool, it is stopped by the context
+        monitor = evaluate_pooled_service(test_case, prefix, context, cleanup_funcs)
+    elif test_case.config:
+        with context.tracer.span('start', test_case):
+            api_running_process, cleanup = evaluate_api_running(test_case, cwd, context.workspaces)
         processes.append(api_running_process)
         cleanup_funcs.append(cleanup)
+        kill_on_expiry(test_case, api_running_process)
+        monitor = start_monitor(api_running_process.pid, context, cleanup_funcs)
+        with context.tracer.span('ready', test_case):
+            evaluate_ready(test_case, prefix, cwd, api_running_process)
+    return monitor
+
+
+def evaluate_check(test_case, prefix, cwd, session, tracer, timed=True):
+    """
+    Send the request of a test case and validate the response
+
+    The request span ends once the response headers arrived, reading and
+    comparing the body is timed as validate.
+
+    Args:
+        timed (bool): Add the spans to test_case.timings, off for requests repeated from several threads
+
+    Returns:
+        tuple: (status code, description of the first difference or None if the response matched)
+    """
+    timed_case = test_case if timed else None
+    with tracer.span('request', timed_case):
+        resp = evaluate_request(test_case.request, prefix, cwd, session, request_timeout(test_case))
+    with resp, tracer.span('validate', timed_case):
+        if test_case.response_body:
+            return resp.status_code, validate_response(test_case.response, resp.status_code, resp.iter_content(CHUNK_SIZE))
+        # Drain the body so the connection goes back to the pool
+        for _ in resp.iter_content(CHUNK_SIZE):
+            pass
+    return resp.status_code, None
+
+
+def evaluate_step(test_case, step, prefix, cwd, session, tracer, variables):
+    """
+    Send the request of one step of a test case, see render_step
+
+    The body of a step with captures is read whole, its captured values are
+    added to variables for the following steps.
+
+    Returns:
+        tuple: (status code, description of the first difference or None), see evaluate_check
+    """
+    if not step.request:
+        return None, "no request"
+    case = step_case(test_case, step)
+    if not step.captures:
+        return evaluate_check(case, prefix, cwd, session, tracer)
+    with tracer.span('request', test_case):
+        resp = evaluate_request(step.request, prefix, cwd, session, request_timeout(test_case))
+    with resp, tracer.span('validate', test_case):
+        body = resp.content
+        if step.response_body:
+            failure = validate_response(step.response, resp.status_code, [body])
+            if failure is not None:
+                return resp.status_code, failure
+        variables.update(capture_values(step.captures, resp.headers, body))
+    return resp.status_code, None
+
+
+def evaluate_scenario(test_case, variables, prefix, cwd, session, tracer):
+    """
+    Run the steps of a test case in order over one connection, up to the first failed one
+
+    Returns:
+        tuple: (status code of the last response, description of the failure or None)
+    """
+    status_code = None
+    for number, step in enumerate(test_case.steps, 1):
+        try:
+            step = render_step(step, variables)
+            status_code, failure = evaluate_step(test_case, step, prefix, cwd, session, tracer, variables)
+        except (TemplateError, CaptureError) as e:
+            failure = str(e)
+        if failure is not None:
+            if len(test_case.steps) > 1:
+                failure = f"{describe_step(number, step)}: {failure}"
+            return status_code, failure
+    return status_code, None
+
+
+def evaluate_rows(test_case, prefix, cwd, context):
+    """
+    Run the steps of a test case once per row of its matrix and data file
+
+    The rows share the setup of the test case and are sent one after the
+    other over the same pooled connection.
+
+    Returns:
+        RowResults: Number of rows checked and the first failed ones
+    """
+    session = context.sessions.get()
+    rows = RowResults()
+    for index, row in enumerate(iter_rows(test_case)):
+        _, failure = evaluate_scenario(test_case, row_variables(test_case, row), prefix, cwd, session,
+                                       context.tracer)
+        rows.add(index, row, failure)
+    return rows
+
+
+def evaluate_performance(test_case, prefix, cwd, context):
+    """
+    Repeat the request of a test case and check its latency and throughput budgets
+
+    Returns:
+        tuple: (report dict, description of the first missed budget or None), see check_performance
+    """
+    # load sends its requests through evaluate_check and imports this module
+    from load import LoadTarget, drive, check_performance
+
+    performance = test_case.performance
+    with context.tracer.span('repeat', test_case):
+        histogram, errors, failures, elapsed = drive([LoadTarget(test_case, prefix, cwd)], context,
+                                                     performance.concurrency, limit=performance.repeat)
+    return check_performance(performance, histogram, errors, failures, elapsed)
+
+
+def evaluate(test_case, directory, prefix, context):
+    print(f"test_case: {test_case.title}\n", end='', flush=True)
+    processes = []
 
-    # run test case
-    if test_case.request:
-        resp = evaluate_request(test_case.request, prefix, cwd)
-    
-    if test_case.response_body:
-        expected_resp = test_case.response
-        if resp.status_code != expected_resp.status_code:
-            return False
-        if resp.body != expected_resp.body:
-            return False
+    cleanup_funcs = []
+    result = TestResult(test_case)
+    try:
+        # Every test gets its own workspace; the current directory is never
+        # changed so that several tests can be evaluated from different threads at once.
+        cwd = context.workspaces.create()
+        result.workspace = cwd
+        monitor = None
+        # Replayed responses need neither fixtures nor the web.command
+        if not context.replaying:
+            with within(test_case, 'setup'):
+                monitor = evaluate_setup(test_case, prefix, cwd, context, processes, cleanup_funcs)
+        prefix = evaluate_replay(test_case, directory, prefix, context, cleanup_funcs)
+
+        # run test case
+        if test_case.request and test_case.has_rows:
+            result.request = f"{test_case.request.method} {test_case.request.url}"
+            rows = evaluate_rows(test_case, prefix, cwd, context)
+            result.rows = rows.to_dict()
+            if rows.failed:
+                result.fail(TestResult.FAILED, rows.message())
+        elif test_case.has_steps:
+            result.request = f"{test_case.request.method} {test_case.request.url}" if test_case.request else ""
+            status_code, failure = evaluate_scenario(test_case, dict(test_case.env.env), prefix, cwd,
+                                                     context.sessions.get(), context.tracer)
+            result.response = str(status_code)
+            if failure is not None:
+                result.fail(TestResult.FAILED, failure)
+        elif test_case.request:
+            result.request = f"{test_case.request.method} {test_case.request.url}"
+            case = render_case(test_case, dict(test_case.env.env))
+            status_code, failure = evaluate_check(case, prefix, cwd, context.sessions.get(), context.tracer)
+            result.response = str(status_code)
+            if failure is not None:
+                result.fail(TestResult.FAILED, failure)
+
+            # Budgets are only checked once the response is known to be right
+            if test_case.performance is not None and result.status == TestResult.PASSED:
+                result.performance, failure = evaluate_performance(case, prefix, cwd, context)
+                if failure is not None:
+                    result.fail(TestResult.FAILED, failure)
+
+        if monitor is not None:
+            result.resources = monitor.stop()
+        # No service runs when replaying, so there is nothing to hold to the limits
+        failure = None if context.replaying else check_limits(test_case.limits, result.resources)
+        if failure is not None and result.status == TestResult.PASSED:
+            result.fail(TestResult.FAILED, failure)
+    except (ReadyError, FixtureError, TemplateError, DataFileError, TimeoutExpired, requests.RequestException,
+            OSError) as e:
+        result.fail(TestResult.ERROR, str(e))
+    # Whatever failed once the deadline expired failed because of it
+    if test_case.deadline is not None and test_case.deadline.overdue() is not None:
+        result.fail(TestResult.ERROR, test_case.deadline.expired)
 
     # for thread in processes:
     #     thread.join()
@@ -212,12 +519,88 @@ def evaluate(test_case, directory, prefix):
     # for thread in processes:
     #     thread.terminate()
 
-    return processes, cleanup_funcs
+    return result, processes, cleanup_funcs
+
+
+def release_workspace(result, workspaces):
+    """Remove the workspace of a finished test case, result.workspace stays set when it is kept"""
+    if result.workspace is not None and not workspaces.release(result.workspace, result.passed):
+        result.workspace = None
+
+
+def stop_reason(context, failed, maxfail=None):
+    """
+    Why no further test case is to be started
+
+    Args:
+        failed (int): Test cases that failed or errored so far
+        maxfail (int): Failures after which the run stops, None to run every test case
+
+    Returns:
+        str: Reason, reported with the skipped test cases, None while they are to be run
+    """
+    if context.run_deadline.expired is not None:
+        return f"not run, {context.run_deadline.expired}"
+    if maxfail is not None and failed >= maxfail:
+        return f"not run, maxfail of {maxfail} reached"
+    return None
+
+
+def run_test(test_case, directory, prefix, context, port=None):
+    """
+    Evaluate a test case and tear down everything it started
+
+    Args:
+        test_case (TestCase): Test case to run
+        directory (str): Directory of running test
+        prefix (str): Prefix of the api test, may reference ${PORT}
+        context (RunContext): Resources shared with the other test cases
+        port (int): Port reserved for this test's web.command, exposed as ${PORT}
+
+    Returns:
+        TestResult: Outcome of the test case
+    """
+    if test_case.parse_error is not None:
+        return TestResult(test_case, TestResult.ERROR, test_case.parse_error)
+    if port is not None:
+        test_case.env.env['PORT'] = str(port)
+    try:
+        prefix = test_case.env.render(evaluate_stub(test_case, prefix, context))
+    except (TemplateError, OSError) as e:
+        return TestResult(test_case, TestResult.ERROR, str(e))
+
+    context.start_deadline(test_case)
+    try:
+        with profile(context.profile_dir, test_case):
+            result, processes, cleanup_funcs = evaluate(test_case, directory, prefix, context)
+            with context.tracer.span('cleanup', test_case):
+                for cleanup in cleanup_funcs:
+                    cleanup()
+                for process in processes:
+                    process.join()
+                    if process.usage() is not None:
+                        result.rusage = process.usage()
+                release_workspace(result, context.workspaces)
+    finally:
+        context.finish_deadline(test_case)
+    return result
+
+def read_tests_from_file(file_path):
+    """Yield the test cases of a file while it is being read line by line"""
+    with open(file_path, 'r') as fp:
+        yield from parse_tests(fp)
+
+def parse_tests_from_file(file_path, cache=None):
+    """Test cases of a file, loaded from the parse cache when one is given"""
+    tests = read_tests_from_file(file_path) if cache is None else cache.parse(file_path, read_tests_from_file)
+    # Set as they are yielded, the cache is shared by runs from other directories
+    for index, test_case in enumerate(tests):
+        test_case.file = file_path
+        test_case.index = index
+        yield test_case
 
 def parse_test_from_file(file_path):
-    with open(file_path, 'r') as fp:
-        test_content = fp.read()
-    return parse_test(test_content)
+    return next(parse_tests_from_file(file_path), TestCase())
 
 def run_test_from_file(file_path):
     test_case = parse_test_from_file(file_path)
@@ -228,7 +611,8 @@ def parse_test_suite_from_dir(dir_path):
     test_suite = TestSuite()
     files = glob.glob(os.path.join(dir_path, "*.t"))
     for file in files:
-        test_suite.add_test(parse_test_from_file(os.path.join(dir_path, file)))
+        for test_case in parse_tests_from_file(file):
+            test_suite.add_test(test_case)
     return test_suite
 
 def test_suite_from_dir(dir_path):
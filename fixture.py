@@ -0,0 +1,134 @@
+import hashlib
+import os
+import subprocess
+import threading
+from supervisor import SupervisedProcess
+from ready import CommandProbe, ReadyError, wait_ready
+from workspace import Workspaces
+
+
+# Expanded by bash inside the db container, from the environment docker
+# compose gave it
+INIT_SQL_COMMAND = 'mysql -u"$MYSQL_USER" -p"$MYSQL_PASSWORD" "$MYSQL_DATABASE"'
+
+
+class FixtureError(Exception):
+    pass
+
+
+def fixture_key(test_case):
+    """Hash of the rendered docker compose and mysql config of a test case"""
+    digest = hashlib.sha1()
+    digest.update(test_case.env.render(test_case.docker_compose_config).encode())
+    digest.update(b'\0')
+    digest.update(test_case.env.render(test_case.mysql_config).encode())
+    return digest.hexdigest()
+
+
+class Fixture(object):
+    """A docker compose stack that is shared by every test case declaring it"""
+
+    def __init__(self, key, workspaces, timeout):
+        self.key = key
+        self.workspaces = workspaces
+        self.cwd = None  # Workspace of the stack, created when it is brought up
+        self.timeout = timeout
+        self.process = None
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f"key: {self.key}, cwd: {self.cwd}"
+
+    def up(self, test_case):
+        if self.cwd is None:
+            # The directory name is the compose project name
+            self.cwd = self.workspaces.create(prefix=f"fixture_{self.key[:12]}_")
+
+        self.workspaces.write(self.cwd, 'my.cnf', test_case.env.render(test_case.mysql_config))
+
+        # Executed by the mysql entrypoint on first boot only, later test
+        # cases re-apply their own init_sql through apply_init_sql
+        self.workspaces.write(self.cwd, 'init.sql', test_case.env.render(test_case.init_sql))
+
+        self.workspaces.write(self.cwd, 'docker-compose.yaml', test_case.env.render(test_case.docker_compose_config))
+
+        process = SupervisedProcess('docker', ['compose', 'up'], self.cwd, log_path=os.path.join(self.cwd, 'compose.log'))
+        process.run()
+
+        # 需要等待进程完全启动后返回
+        try:
+            wait_ready([CommandProbe(['mysqladmin', 'ping', '-h127.0.0.1', '--silent'])],
+                       timeout=self.timeout, process=process)
+        except ReadyError:
+            process.terminate()
+            raise
+
+        self.process = process
+
+    def apply_init_sql(self, test_case, cwd):
+        """Run the init_sql of a test case against the already running stack, raises FixtureError if it fails"""
+        init_sql = self.workspaces.write(cwd, 'init.sql', test_case.env.render(test_case.init_sql))
+
+        with open(init_sql, 'r') as fp:
+            result = subprocess.run(['docker', 'compose', 'exec', '-T', 'db', 'bash', '-c', INIT_SQL_COMMAND],
+                                    cwd=self.cwd, stdin=fp)
+        if result.returncode != 0:
+            raise FixtureError(f"init_sql of {test_case.title} exited with {result.returncode}")
+
+    def down(self):
+        if self.process is None:
+            return
+        down = SupervisedProcess('docker', ['compose', 'down'], self.cwd, log_path=os.path.join(self.cwd, 'compose.log'))
+        down.run()
+        down.join()
+        self.process.terminate()
+        self.process = None
+
+
+class FixtureCache(object):
+    """
+    Brings every distinct docker compose stack up once per run
+
+    Stacks are keyed by fixture_key, so test cases with an identical rendered
+    docker_compose_config and mysql_config share one set of containers and
+    only re-apply their init_sql.
+    """
+
+    def __init__(self, workspaces=None, timeout=120.0):
+        self.workspaces = workspaces if workspaces is not None else Workspaces()
+        self.timeout = timeout  # Seconds mysql may take to answer a ping
+        self.fixtures = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, test_case, cwd):
+        """
+        Return the running fixture for a test case, starting it if needed
+
+        Args:
+            test_case (TestCase): Test case declaring docker_compose_config
+            cwd (str): Workspace of the test case, init.sql is written there
+
+        Returns:
+            Fixture: The shared fixture
+        """
+        key = fixture_key(test_case)
+        with self.lock:
+            fixture = self.fixtures.get(key)
+            if fixture is None:
+                fixture = Fixture(key, self.workspaces, self.timeout)
+                self.fixtures[key] = fixture
+
+        with fixture.lock:
+            if fixture.process is None:
+                print(f"Starting fixture {fixture.key[:12]} for {test_case.title}")
+                fixture.up(test_case)
+            else:
+                fixture.apply_init_sql(test_case, cwd)
+        return fixture
+
+    def close(self):
+        with self.lock:
+            fixtures = list(self.fixtures.values())
+            self.fixtures = {}
+        for fixture in fixtures:
+            fixture.down()
@@ -0,0 +1,91 @@
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+
+def bucket_index(value):
+    """Index of the log-linear bucket holding an integer value"""
+    if value < 2 * SUB_BUCKET_HALF:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return shift * SUB_BUCKET_HALF + (value >> shift)
+
+
+def bucket_bounds(index):
+    """Lowest and highest value of a bucket"""
+    if index < 2 * SUB_BUCKET_HALF:
+        return index, index
+    shift = index // SUB_BUCKET_HALF - 1
+    lowest = (index - shift * SUB_BUCKET_HALF) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+
+class Histogram(object):
+    """
+    HDR-style latency histogram
+
+    Latencies are recorded in microseconds into log-linear buckets: exact
+    below 128us and within 1/64 (about 1.6%) above, so memory stays a few
+    hundred counters whatever the number of samples. Histograms of
+    different workers are combined with merge().
+    """
+
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, seconds):
+        value = max(0, int(seconds * 1000000))
+        index = bucket_index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """
+        Args:
+            percent (float): Percentile between 0 and 100
+
+        Returns:
+            float: Latency in seconds that percent of the samples do not exceed
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_bounds(index)[1], self.max) / 1000000
+        return self.max / 1000000
+
+    def mean(self):
+        return self.total / self.count / 1000000 if self.count else 0.0
+
+    def summary(self):
+        """Percentiles in milliseconds, as reported by load and latency checks"""
+        return {
+            'count': self.count,
+            'mean': round(self.mean() * 1000, 3),
+            'p50': round(self.percentile(50) * 1000, 3),
+            'p90': round(self.percentile(90) * 1000, 3),
+            'p99': round(self.percentile(99) * 1000, 3),
+            'max': round(self.max / 1000, 3),
+        }
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from base import TestResult
+from report import Reporter
+from template import TemplateError, render
+
+RESULTS_VERSION = 1
+
+
+def test_key(test_case):
+    """Stable identity of a test case across runs"""
+    return f"{os.path.abspath(test_case.file or '')}:{test_case.index}"
+
+
+def stat_token(path):
+    """mtime and size of a file, None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def referenced_files(test_case, variables):
+    """
+    Files outside the block the outcome of a test case depends on
+
+    These are the web.command binary and those of its arguments, the data
+    file, and the relative or absolute paths mentioned by the docker compose
+    config, that exist on disk.
+    """
+    base_dir = os.path.dirname(os.path.abspath(test_case.file or '.'))
+    candidates = []
+    if test_case.web is not None and test_case.web.command:
+        command = render(test_case.web.command, variables)
+        candidates.append(shutil.which(command) or command)
+        candidates.extend(render(arg, variables) for arg in test_case.web.args)
+    if test_case.data_file:
+        candidates.append(test_case.data_file)
+    for token in test_case.docker_compose_config.split():
+        token = token.strip('"\',')
+        if token.startswith(('./', '../', '/')):
+            candidates.append(token.split(':', 1)[0])
+
+    files = []
+    for candidate in candidates:
+        path = os.path.join(base_dir, candidate)
+        if os.path.isfile(path):
+            files.append(path)
+    return files
+
+
+def fingerprint(test_case, prefix):
+    """
+    Hash of everything a test result depends on
+
+    Covers the lines of the block, the environment it renders to, the prefix
+    and the mtime and size of the referenced files. ${PORT} changes between
+    runs and is left unrendered.
+
+    Returns:
+        str: Hex digest, None if the test case can not be fingerprinted
+    """
+    if test_case.digest is None:
+        return None
+    variables = dict(test_case.env.env, PORT='${PORT}')
+    digest = hashlib.sha1()
+    digest.update(test_case.digest.encode())
+    digest.update(prefix.encode())
+    try:
+        for name in sorted(test_case.env.env):
+            digest.update(f"{name}={render(test_case.env.env[name], variables)}\n".encode())
+        files = referenced_files(test_case, variables)
+    except TemplateError:
+        return None
+    for path in files:
+        digest.update(f"{path}={stat_token(path)}\n".encode())
+    return digest.hexdigest()
+
+
+class ResultsCache(Reporter):
+    """
+    Fingerprint and status of the last run of every test case
+
+    Stored as one JSON file, read when the run starts and written back when
+    it ends. As a reporter it records every result of the run; skipped test
+    cases keep their previous entry.
+    """
+
+    def __init__(self, path, prefix):
+        self.path = path
+        self.prefix = prefix
+        self.entries = {}
+        self.fingerprints = {}
+        try:
+            with open(path, 'r') as fp:
+                data = json.load(fp)
+            if data.get('version') == RESULTS_VERSION:
+                self.entries = data['tests']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def previous(self, test_case):
+        """
+        Returns:
+            dict: fingerprint and status of the last run, None if it never ran
+        """
+        return self.entries.get(test_key(test_case))
+
+    def unchanged(self, test_case):
+        """Whether the test case passed last time and nothing it depends on changed since"""
+        key = test_key(test_case)
+        current = self.fingerprints.get(key)
+        if current is None:
+            current = self.fingerprints[key] = fingerprint(test_case, self.prefix)
+        entry = self.entries.get(key)
+        return (current is not None and entry is not None and entry['fingerprint'] == current
+                and entry['status'] == TestResult.PASSED)
+
+    def add(self, result):
+        if result.status == TestResult.SKIPPED:
+            return
+        key = f"{os.path.abspath(result.file or '')}:{result.index}"
+        current = self.fingerprints.get(key)
+        if current is None:
+            self.entries.pop(key, None)
+            return
+        self.entries[key] = {'fingerprint': current, 'status': result.status}
+
+    def close(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fp:
+            json.dump({'version': RESULTS_VERSION, 'tests': self.entries}, fp)
+        os.replace(tmp_path, self.path)
+
+
+def select(tests, cache, reporter, changed_only=False, failed_first=False):
+    """
+    Filter and order test cases using the results of the last run
+
+    Args:
+        tests (iterable): Test cases, consumed lazily
+        cache (ResultsCache): Results of the last run, fingerprints every test case
+        reporter (Reporter): Receives a skipped result for every test case left out
+        changed_only (bool): Leave out test cases that passed and did not change since
+        failed_first (bool): Run test cases that failed last time before the others
+
+    Yields:
+        TestCase: Test cases to run
+    """
+    later = []
+    for test_case in tests:
+        if cache.unchanged(test_case):
+            if changed_only:
+                reporter.add(TestResult(test_case, TestResult.SKIPPED, "unchanged since it last passed"))
+                continue
+        if failed_first:
+            previous = cache.previous(test_case)
+            if previous is None or previous['status'] == TestResult.PASSED:
+                # Held back until every failed test case has been started
+                later.append(test_case)
+                continue
+        yield test_case
+    yield from later
@@ -0,0 +1,228 @@
+import itertools
+import threading
+import time
+import requests
+from deadline import Deadline, TimeoutExpired
+from evaluate import free_port, evaluate_setup, evaluate_check, evaluate_stub
+from fixture import FixtureError
+from histogram import Histogram
+from matrix import DataFileError, iter_rows, row_variables
+from ready import ReadyError
+from scenario import render_case, render_step, step_case
+from session import SessionPool
+from template import TemplateError
+
+# Rows of a matrix or data file turned into targets, the load cycles through them
+MAX_ROW_TARGETS = 1000
+
+
+class LoadTarget(object):
+    """A test case whose services are running, ready to be driven"""
+
+    def __init__(self, test_case, prefix, cwd):
+        self.test_case = test_case
+        self.prefix = prefix
+        self.cwd = cwd
+
+
+def setup_targets(test_cases, prefix, context, processes, cleanup_funcs):
+    """
+    Start the services of every test case once, each on its own port
+
+    Test cases whose setup fails are reported and left out of the load. A
+    test case with a matrix or data file gives one target per row, sharing
+    its services. Only the first step of a scenario is driven, the others
+    depend on the values it captures.
+
+    Returns:
+        list: LoadTarget of every test case (or row) with a request
+    """
+    targets = []
+    for test_case in test_cases:
+        if test_case.parse_error is not None:
+            print(f"{test_case.title}: {test_case.parse_error}")
+            continue
+        if not test_case.request:
+            continue
+        test_case.env.env['PORT'] = str(free_port())
+        # Only the request timeout applies, the load has its own duration
+        test_case.deadline = Deadline(request_timeout=dict(context.timeouts, **test_case.timeouts).get('request'))
+        try:
+            # Removed with the run directory when the context is closed
+            cwd = context.workspaces.create()
+            target_prefix = test_case.env.render(evaluate_stub(test_case, prefix, context))
+            evaluate_setup(test_case, target_prefix, cwd, context, processes, cleanup_funcs)
+            if test_case.has_rows:
+                cases = [step_case(test_case, render_step(test_case.steps[0], row_variables(test_case, row)))
+                         for row in itertools.islice(iter_rows(test_case), MAX_ROW_TARGETS)]
+            else:
+                cases = [render_case(test_case, dict(test_case.env.env))]
+        except (ReadyError, FixtureError, TemplateError, DataFileError, OSError) as e:
+            print(f"{test_case.title}: {e}")
+            continue
+        targets.extend(LoadTarget(case, target_prefix, cwd) for case in cases)
+    return targets
+
+
+class LoadWorker(threading.Thread):
+    """Sends requests until the deadline or the request limit, recording latencies in its own histogram"""
+
+    def __init__(self, targets, sessions, tracer, counter, start_time, deadline, rps, limit=None):
+        super().__init__(daemon=True)
+        self.targets = targets
+        self.sessions = sessions
+        self.tracer = tracer
+        self.counter = counter
+        self.start_time = start_time
+        self.deadline = deadline
+        self.rps = rps
+        self.limit = limit
+        self.histogram = Histogram()
+        self.errors = 0
+        self.failures = {}
+
+    def run(self):
+        session = self.sessions.get()
+        while True:
+            sequence = next(self.counter)
+            if self.limit is not None and sequence >= self.limit:
+                return
+            if self.rps:
+                # Latency is measured from the scheduled send time, so a slow
+                # service is not hidden by requests queueing behind it
+                scheduled = self.start_time + sequence / self.rps
+                if scheduled >= self.deadline:
+                    return
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                scheduled = time.monotonic()
+                if scheduled >= self.deadline:
+                    return
+
+            target = self.targets[sequence % len(self.targets)]
+            try:
+                _, failure = evaluate_check(target.test_case, target.prefix, target.cwd, session, self.tracer,
+                                            timed=False)
+            except requests.RequestException as e:
+                failure = type(e).__name__
+            except TimeoutExpired:
+                # The test case ran out of time, its evaluation reports it
+                return
+            self.histogram.record(time.monotonic() - scheduled)
+            if failure is not None:
+                self.errors += 1
+                key = f"{target.test_case.title}: {failure}"
+                self.failures[key] = self.failures.get(key, 0) + 1
+
+
+def drive(targets, context, concurrency, duration=None, rps=None, limit=None):
+    """
+    Send the requests of the targets round robin
+
+    Args:
+        targets (list): LoadTarget objects, see setup_targets
+        context (RunContext): Provides the tracer and the pool size of the sessions
+        concurrency (int): Number of workers sending requests
+        duration (float): Seconds to send requests for, unbounded if None
+        rps (float): Target requests per second over all workers, as fast as possible if None
+        limit (int): Number of requests to send, unbounded if None
+
+    Returns:
+        tuple: (Histogram, errors, failures by message, elapsed seconds)
+    """
+    counter = itertools.count()
+    # The workers are new threads every time, their sessions are closed with them
+    # rather than kept in the pool of the run until it ends
+    sessions = SessionPool(context.sessions.pool_size)
+    start_time = time.monotonic()
+    deadline = start_time + duration if duration is not None else float('inf')
+    workers = [LoadWorker(targets, sessions, context.tracer, counter, start_time, deadline, rps, limit)
+               for _ in range(concurrency)]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - start_time
+    finally:
+        sessions.close()
+
+    histogram = Histogram()
+    errors = 0
+    failures = {}
+    for worker in workers:
+        histogram.merge(worker.histogram)
+        errors += worker.errors
+        for key, count in worker.failures.items():
+            failures[key] = failures.get(key, 0) + count
+    return histogram, errors, failures, elapsed
+
+
+def run_load(targets, context, concurrency, duration, rps=None):
+    """
+    Drive the requests of the targets round robin for a duration
+
+    Returns:
+        dict: Throughput, error rate, latency percentiles and failures
+    """
+    histogram, errors, failures, elapsed = drive(targets, context, concurrency, duration, rps)
+    return {
+        'requests': histogram.count,
+        'duration': round(elapsed, 3),
+        'throughput': round(histogram.count / elapsed, 1) if elapsed else 0.0,
+        'errors': errors,
+        'error_rate': round(errors / histogram.count, 4) if histogram.count else 0.0,
+        'latency_ms': histogram.summary(),
+        'failures': failures,
+    }
+
+
+def check_performance(performance, histogram, errors, failures, elapsed):
+    """
+    Compare repeated requests of a test case with its latency and throughput budgets
+
+    Args:
+        performance (Performance): Budgets of the test case
+        histogram (Histogram): Latencies of the repeated requests
+        errors (int): Number of requests that failed
+        failures (dict): Count of every failure description
+        elapsed (float): Seconds spent sending the requests
+
+    Returns:
+        tuple: (report dict, description of the first missed budget or None)
+    """
+    throughput = histogram.count / elapsed if elapsed else 0.0
+    latency = histogram.summary()
+    for percentile, _ in performance.max_latency:
+        latency[f"p{percentile:g}"] = round(histogram.percentile(percentile) * 1000, 3)
+    report = {
+        'requests': histogram.count,
+        'concurrency': performance.concurrency,
+        'duration': round(elapsed, 3),
+        'throughput': round(throughput, 1),
+        'errors': errors,
+        'latency_ms': latency,
+    }
+
+    if errors:
+        example = max(failures, key=failures.get)
+        return report, f"{errors} of {histogram.count} repeated requests failed, e.g. {example}"
+    for percentile, budget in performance.max_latency:
+        value = histogram.percentile(percentile)
+        if value > budget:
+            return report, f"p{percentile:g} latency {value * 1000:.3f}ms exceeds {budget * 1000:g}ms"
+    if performance.min_rps is not None and throughput < performance.min_rps:
+        return report, f"throughput {throughput:.1f} req/s below {performance.min_rps:.10g}"
+    return report, None
+
+
+def print_report(report):
+    latency = report['latency_ms']
+    print(f"\nrequests: {report['requests']} in {report['duration']}s, {report['throughput']} req/s")
+    print(f"errors: {report['errors']} ({report['error_rate'] * 100:.2f}%)")
+    print(f"latency ms: p50 {latency['p50']}, p90 {latency['p90']}, p99 {latency['p99']}, "
+          f"max {latency['max']}, mean {latency['mean']}")
+    for key, count in sorted(report['failures'].items(), key=lambda item: -item[1]):
+        print(f"  {count} x {key}")
@@ -2,76 +2,291 @@
 
 import os
 import sys
-import glob
+import json
+import queue
 import signal
-import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import click
-from base import TestSuite, TestCase
-from evaluate import parse_test_from_file, evaluate
+from base import TestResult
+from evaluate import parse_tests_from_file, run_test, free_port, stop_reason, RunContext
+from session import SessionPool
+from service_pool import ServicePool
+from parse_cache import ParseCache
+from parser import parse_duration, parse_size
+from load import setup_targets, run_load, print_report
+from timing import Tracer
+from report import ConsoleReporter, JUnitReporter, JsonLinesReporter, MultiReporter
+from incremental import ResultsCache, select
+from discovery import discover
+from workspace import Workspaces
 
-def scan_test_files(directory):
-    """Scan for .t test files in the specified directory's 't' subdirectory"""
+def scan_test_files(directory, include=(), exclude=(), keywords=(), shard=None):
+    """
+    Find the test blocks to run below the directory's 't' subdirectory
+
+    Returns:
+        dict: Selected block indexes of every test file, see discovery.discover
+    """
     test_dir = os.path.join(directory, 't')
     if not os.path.exists(test_dir):
         print(f"Test directory not found: {test_dir}")
-        return []
-    return glob.glob(os.path.join(test_dir, '*.t'))
+        return {}
+    test_files, total = discover(test_dir, include or ('*.t',), exclude, keywords, shard)
+    selected = sum(len(indexes) for indexes in test_files.values())
+    if selected != total:
+        print(f"Selected {selected} of {total} test cases")
+    return test_files
 
 def cleanup(processes):
     """Cleanup function to terminate processes and remove config files"""
     for process in processes:
         try:
             process.terminate()
-            process.wait()
-        except:
+        except OSError:
             pass
 
-@click.command()
-@click.option('--directory', '-d', default='.', help='directory of running test')
-@click.option('--prefix', '-p', default='http://127.0.0.1', help='prefix of the api test')
-def main(directory, prefix):
-    # List to track processes and resources that need cleanup
-    processes = []
+def run_tests(tests, directory, prefix, context, jobs, reporter, maxfail=None):
+    """
+    Run test cases on a pool of `jobs` workers, each owning one port
+
+    Once the budget of the run is spent or maxfail test cases failed, the
+    test cases not started yet are reported as skipped.
+    """
+    ports = queue.Queue()
+    for _ in range(jobs):
+        ports.put(free_port())
+
+    # Test cases are pulled from the (lazy) iterable only as workers free
+    # up, so execution starts before parsing has finished
+    pending = {}
+    # Counted by the workers, so the next test case taken sees every failure so far
+    failed = 0
+    lock = threading.Lock()
+
+    def worker(test):
+        nonlocal failed
+        # Queued test cases may only get a worker once the run was stopped
+        reason = stop_reason(context, failed, maxfail)
+        if reason is not None:
+            return TestResult(test, TestResult.SKIPPED, reason)
+        port = ports.get()
+        try:
+            # One write, so the result lines of other workers cannot land in the middle
+            print(f"\nExecuting test: {test.title}\n", end='', flush=True)
+            result = run_test(test, directory, prefix, context, port)
+        finally:
+            ports.put(port)
+        if not result.passed:
+            with lock:
+                failed += 1
+        return result
+
+    def report(futures):
+        for future in futures:
+            test = pending.pop(future)
+            if future.cancelled():
+                result = TestResult(test, TestResult.SKIPPED, stop_reason(context, failed, maxfail))
+            else:
+                result = future.result()
+            reporter.add(result)
+        if stop_reason(context, failed, maxfail) is not None:
+            # Only succeeds for the test cases no worker picked up yet
+            for future in pending:
+                future.cancel()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for test in tests:
+            if len(pending) >= jobs * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                report(done)
+            reason = stop_reason(context, failed, maxfail)
+            if reason is not None:
+                reporter.add(TestResult(test, TestResult.SKIPPED, reason))
+                continue
+            pending[executor.submit(worker, test)] = test
+        report(list(pending))
+
+def iter_tests(test_files, cache=None, tracer=None):
+    """Yield the selected test cases of every file, parsing them lazily"""
+    tracer = tracer if tracer is not None else Tracer()
+    for test_file, indexes in test_files.items():
+        print(f"\nProcessing test file: {test_file}")
+        tests = parse_tests_from_file(test_file, cache)
+        while True:
+            with tracer.span('parse', file=test_file) as span:
+                span.test_case = next(tests, None)
+            if span.test_case is None:
+                break
+            if span.test_case.index in indexes:
+                yield span.test_case
 
-    # Set up signal handler for graceful shutdown
+def handle_signals(processes, context):
+    """Set up signal handler for graceful shutdown"""
     def signal_handler(signum, frame):
         print("\nCleaning up and exiting...")
         cleanup(processes)
+        context.close()
         sys.exit(0)
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    test_files = scan_test_files(directory)
+def open_tests(options, tracer=None):
+    """Lazily parsed test cases selected by the options, exits when there are none"""
+    test_files = scan_test_files(options['directory'], options['include'], options['exclude'],
+                                 options['keywords'], options['shard'])
     if not test_files:
         print("No test files found")
         sys.exit(1)
 
-    def wait_thread_stop(threads):
-        for thread in threads:
-            thread.join()
+    parse_cache = None if options['no_cache'] else ParseCache(os.path.join(options['cache_dir'], 'parse'))
+    return iter_tests(test_files, parse_cache, tracer)
 
-    test_suite = TestSuite()
-    
+def parse_shard_option(ctx, param, value):
+    """--shard i/n, 1 based on the command line, 0 based in the result"""
+    if value is None:
+        return None
     try:
-        # Process each test file
-        for test_file in test_files:
-            print(f"\nProcessing test file: {test_file}")
-            # TODO: Parse test file and create TestCase objects
-            # Add test cases to test_suite
-            test_case = parse_test_from_file(test_file)
-            test_suite.add_test(test_case)
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise click.BadParameter(f"expected i/n, got {value}")
+    if not 1 <= index <= count:
+        raise click.BadParameter(f"shard {index} out of 1..{count}")
+    return index - 1, count
 
-        # Execute tests
-        for test in test_suite.tests:
-            print(f"\nExecuting test: {test.title}")
-            # TODO: Execute test case and validate results
-            processes, cleanup_funcs = evaluate(test, directory, prefix)
+def parse_signal_option(ctx, param, value):
+    if value is None:
+        return None
+    name = value.upper()
+    try:
+        return signal.Signals[name if name.startswith('SIG') else f"SIG{name}"]
+    except KeyError:
+        raise click.BadParameter(f"unknown signal: {value}")
+
+def parse_duration_option(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_duration(value)
+    except ValueError:
+        raise click.BadParameter(f"invalid duration: {value}")
+
+def parse_size_option(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_size(value)
+    except ValueError:
+        raise click.BadParameter(f"invalid size: {value}")
+
+def open_workspaces(options):
+    return Workspaces(options['workspace_root'], options['workspace_budget'], options['keep_workspaces'])
+
+def open_replay_store(record, replay):
+    """ReplayStore of --record or --replay, None without either"""
+    if record and replay:
+        raise click.UsageError("--record and --replay are mutually exclusive")
+    if not (record or replay):
+        return None
+    # aiohttp is only needed when recording or replaying
+    from replay import ReplayStore
+    try:
+        return ReplayStore(record or replay, recording=bool(record))
+    except (OSError, ValueError) as e:
+        raise click.BadParameter(str(e), param_hint='--record' if record else '--replay')
+
+@click.group(invoke_without_command=True)
+@click.option('--directory', '-d', default='.', help='directory of running test')
+@click.option('--prefix', '-p', default='http://127.0.0.1', help='prefix of the api test, ${PORT} is replaced by the port of the worker')
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1), help='number of test cases running concurrently')
+@click.option('--pool-size', default=10, type=click.IntRange(min=1), help='keep-alive connections kept per host and worker')
+@click.option('--engine', default='thread', type=click.Choice(['thread', 'async']), help='run test cases on a thread pool or on one asyncio event loop')
+@click.option('--cache-dir', default='.api-test-cache', help='directory of the parse and results caches')
+@click.option('--no-cache', is_flag=True, help='always parse test files from scratch')
+@click.option('--trace', default=None, help='write the phases of every test case as a Chrome trace JSON file')
+@click.option('--profile-dir', default=None, help='write a cProfile dump per test case to this directory')
+@click.option('--reuse-services', is_flag=True, help='keep web.command processes running for the next test case with the same command and args')
+@click.option('--reload-signal', default=None, callback=parse_signal_option, help='signal making a reused service reload its config, e.g. HUP; restarted if not set')
+@click.option('--monitor-interval', default='100ms', callback=parse_duration_option, help='how often to sample the resource usage of the web.command, 0 disables it')
+@click.option('--include', multiple=True, help='glob of test files below t/, on the relative path or name (default *.t)')
+@click.option('--exclude', multiple=True, help='glob of test files or directories below t/ to leave out')
+@click.option('-k', 'keywords', multiple=True, help='run test cases whose title contains it or tagged with it, !keyword to leave out')
+@click.option('--shard', default=None, callback=parse_shard_option, help='run shard i of n, e.g. 2/8')
+@click.option('--timeout', default=None, callback=parse_duration_option, help='time a test case may take, e.g. 60s; its timeout section overrides it')
+@click.option('--setup-timeout', default=None, callback=parse_duration_option, help='time the fixtures and web.command of a test case may take to get ready')
+@click.option('--request-timeout', default='60s', callback=parse_duration_option, help='time a single request may take')
+@click.option('--run-timeout', default=None, callback=parse_duration_option, help='budget of the whole run, running test cases are cancelled and the others skipped once it is spent')
+@click.option('--maxfail', default=None, type=click.IntRange(min=1), help='stop starting test cases after this many failed')
+@click.option('--workspace-root', default=None, help='directory the per-test workspaces are created in (default /dev/shm)')
+@click.option('--workspace-budget', default=None, callback=parse_size_option, help='disk space the workspaces of the run may use, e.g. 512M')
+@click.option('--keep-workspaces', default=Workspaces.KEEP_FAILED, type=click.Choice([Workspaces.KEEP_FAILED, Workspaces.KEEP_ALL, Workspaces.KEEP_NONE]), help='which workspaces are left behind after their test case')
+@click.option('--record', default=None, help='record the responses of the services to this directory')
+@click.option('--replay', default=None, help='answer requests with the responses recorded to this directory, without starting fixtures or services')
+@click.option('--plugin', 'plugins', multiple=True, help='module whose register(tracer) adds timing hooks')
+@click.option('--junit', default=None, help='write a JUnit XML report to this file')
+@click.option('--jsonl', default=None, help='write one JSON line per test case to this file')
+@click.option('--changed-only', is_flag=True, help='skip test cases that passed last time and did not change since')
+@click.option('--failed-first', is_flag=True, help='run test cases that failed last time first')
+@click.pass_context
+def main(ctx, directory, prefix, jobs, pool_size, engine, cache_dir, no_cache, trace, profile_dir, reuse_services,
+         reload_signal, monitor_interval, include, exclude, keywords, shard, timeout, setup_timeout, request_timeout,
+         run_timeout, maxfail, workspace_root, workspace_budget, keep_workspaces, record, replay, plugins, junit, jsonl,
+         changed_only, failed_first):
+    ctx.obj = {
+        'directory': directory,
+        'prefix': prefix,
+        'pool_size': pool_size,
+        'cache_dir': cache_dir,
+        'no_cache': no_cache,
+        'include': include,
+        'exclude': exclude,
+        'keywords': keywords,
+        'shard': shard,
+        'workspace_root': workspace_root,
+        'workspace_budget': workspace_budget,
+        'keep_workspaces': keep_workspaces,
+        'timeouts': {'test': timeout, 'setup': setup_timeout, 'request': request_timeout},
+    }
+    if ctx.invoked_subcommand is not None:
+        return
 
-            # for cleanup in cleanup_funcs:
-            #     cleanup()
+    tracer = Tracer(keep_spans=trace is not None)
+    for plugin in plugins:
+        tracer.load_plugin(plugin)
 
-            # wait_thread_stop(threads)
+    replay_store = open_replay_store(record, replay)
+
+    # List to track processes and resources that need cleanup
+    processes = []
+    workspaces = open_workspaces(ctx.obj)
+    services = ServicePool(workspaces, reload_signal=reload_signal) if reuse_services else None
+    context = RunContext(sessions=SessionPool(pool_size), tracer=tracer, profile_dir=profile_dir, services=services,
+                         monitor_interval=monitor_interval, workspaces=workspaces, timeouts=ctx.obj['timeouts'],
+                         run_timeout=run_timeout, replay_store=replay_store)
+    handle_signals(processes, context)
+
+    tests = open_tests(ctx.obj, tracer)
+
+    reporters = [ConsoleReporter()]
+    if junit:
+        reporters.append(JUnitReporter(junit))
+    if jsonl:
+        reporters.append(JsonLinesReporter(jsonl))
+    results = ResultsCache(os.path.join(cache_dir, 'results.json'), prefix)
+    reporters.append(results)
+    reporter = MultiReporter(reporters)
+
+    tests = select(tests, results, reporter, changed_only, failed_first)
+
+    try:
+        # Execute tests
+        if engine == 'async':
+            # aiohttp is only needed by the asyncio engine
+            import async_engine
+            async_engine.run_tests(tests, directory, prefix, context, jobs, pool_size, reporter, maxfail)
+        else:
+            run_tests(tests, directory, prefix, context, jobs, reporter, maxfail)
 
     except Exception as e:
         print(f"Error during test execution: {str(e)}")
@@ -79,6 +294,49 @@ def main(directory, prefix):
     finally:
         # Cleanup
         cleanup(processes)
+        context.close()
+        reporter.close()
+        if trace is not None:
+            tracer.write_chrome_trace(trace)
+
+    if reporter.failed:
+        sys.exit(1)
+
+@main.command()
+@click.option('--concurrency', '-c', default=1, type=click.IntRange(min=1), help='number of requests in flight')
+@click.option('--rps', default=None, type=click.FloatRange(min=0, min_open=True), help='target requests per second, as fast as possible if not set')
+@click.option('--duration', '-D', default='10s', callback=parse_duration_option, help='how long to send requests, e.g. 30s or 2m')
+@click.option('--output', '-o', default=None, help='also write the report as JSON to this file')
+@click.pass_obj
+def load(options, concurrency, rps, duration, output):
+    """Drive the requests of the test files as a load test"""
+    processes = []
+    cleanup_funcs = []
+    context = RunContext(sessions=SessionPool(options['pool_size']), workspaces=open_workspaces(options),
+                         timeouts=options['timeouts'])
+    handle_signals(processes, context)
+
+    tests = open_tests(options)
+
+    try:
+        targets = setup_targets(tests, options['prefix'], context, processes, cleanup_funcs)
+        if not targets:
+            print("No test case to drive")
+            sys.exit(1)
+
+        report = run_load(targets, context, concurrency, duration, rps)
+        print_report(report)
+        if output:
+            with open(output, 'w') as fp:
+                json.dump(report, fp, indent=2)
+    finally:
+        for cleanup_func in cleanup_funcs:
+            cleanup_func()
+        cleanup(processes)
+        context.close()
+
+    if report['errors']:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,89 @@
+import csv
+import json
+import os
+
+# Failed rows kept in the result, the others are only counted
+MAX_REPORTED_ROWS = 10
+
+
+class DataFileError(Exception):
+    pass
+
+
+def data_file_path(test_case):
+    """Path of the data file of a test case, relative to its .t file"""
+    base_dir = os.path.dirname(os.path.abspath(test_case.file or '.'))
+    return os.path.join(base_dir, test_case.data_file)
+
+
+def iter_rows(test_case):
+    """
+    Rows of variables of a test case: those of its matrix, then those of its data file
+
+    The data file is read one line at a time while the rows are checked, a
+    .jsonl (or .ndjson) file holds one JSON object per line, any other file
+    is read as CSV with a header line.
+    """
+    if test_case.matrix is not None:
+        yield from test_case.matrix
+    if not test_case.data_file:
+        return
+    path = data_file_path(test_case)
+    with open(path, 'r', newline='') as fp:
+        if path.endswith(('.jsonl', '.ndjson')):
+            for number, line in enumerate(fp, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    raise DataFileError(f"{test_case.data_file}:{number}: {e}")
+                if not isinstance(row, dict):
+                    raise DataFileError(f"{test_case.data_file}:{number}: expected a JSON object")
+                yield row
+        else:
+            yield from csv.DictReader(fp)
+
+
+def row_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list, bool)):
+        return json.dumps(value)
+    return str(value)
+
+
+def row_variables(test_case, row):
+    """Variables the steps are rendered with for one row, laid over those of the env section"""
+    variables = dict(test_case.env.env)
+    variables.update((name, row_value(value)) for name, value in row.items())
+    return variables
+
+
+def describe_row(row):
+    return ', '.join(f"{name}={row_value(value)}" for name, value in row.items())
+
+
+class RowResults(object):
+    """Outcome of the rows of a test case, counted as they are checked"""
+
+    def __init__(self):
+        self.total = 0
+        self.failed = 0
+        self.failures = []  # The first MAX_REPORTED_ROWS failed rows
+
+    def add(self, index, row, failure):
+        self.total += 1
+        if failure is None:
+            return
+        self.failed += 1
+        if len(self.failures) < MAX_REPORTED_ROWS:
+            self.failures.append({'row': index, 'variables': describe_row(row), 'message': failure})
+
+    def message(self):
+        first = self.failures[0]
+        return (f"{self.failed} of {self.total} rows failed, "
+                f"first row {first['row']} ({first['variables']}): {first['message']}")
+
+    def to_dict(self):
+        return {'total': self.total, 'failed': self.failed, 'failures': self.failures}
@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def read_stat(pid):
+    """
+    CPU ticks, thread count, RSS and parent of a process from /proc/<pid>/stat
+
+    Returns:
+        tuple: (cpu ticks, threads, rss bytes, parent pid)
+    """
+    with open(f"/proc/{pid}/stat", 'r') as fp:
+        stat = fp.read()
+    # The command name may contain spaces and parentheses, fields start after the last ")"
+    fields = stat[stat.rindex(')') + 2:].split()
+    return int(fields[11]) + int(fields[12]), int(fields[17]), int(fields[21]) * PAGE_SIZE, int(fields[1])
+
+
+def children(pid):
+    """Direct children of a process"""
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return []
+    result = []
+    for tid in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children", 'r') as fp:
+                result.extend(int(child) for child in fp.read().split())
+        except FileNotFoundError:
+            # Kernel without CONFIG_PROC_CHILDREN, scan every process instead
+            return [other for other in all_pids() if parent_of(other) == pid]
+        except OSError:
+            continue
+    return result
+
+
+def all_pids():
+    return [int(name) for name in os.listdir('/proc') if name.isdigit()]
+
+
+def parent_of(pid):
+    try:
+        return read_stat(pid)[3]
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_tree(pid):
+    """A process and all of its descendants"""
+    pids = []
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        pending.extend(children(current))
+    return pids
+
+
+def tree_usage(pid):
+    """
+    Resource usage summed over the process tree of pid
+
+    Returns:
+        dict: cpu_ticks, rss (bytes), fds and threads, None if the process is gone
+    """
+    usage = {'cpu_ticks': 0, 'rss': 0, 'fds': 0, 'threads': 0}
+    found = False
+    for member in process_tree(pid):
+        try:
+            ticks, threads, rss, _ = read_stat(member)
+            fds = len(os.listdir(f"/proc/{member}/fd"))
+        except (OSError, ValueError, IndexError):
+            # Exited between listing and reading
+            continue
+        found = True
+        usage['cpu_ticks'] += ticks
+        usage['rss'] += rss
+        usage['fds'] += fds
+        usage['threads'] += threads
+    return usage if found else None
+
+
+class Monitor(object):
+    """
+    Samples the process tree of a service from /proc on a background thread
+
+    Keeps the peaks of RSS, CPU percentage (of one core, between two
+    samples), open file descriptors and threads over all samples.
+    """
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.samples = 0
+        self.peaks = {'rss': 0, 'cpu_percent': 0.0, 'fds': 0, 'threads': 0}
+        self.last = None  # (time, cpu ticks) of the previous sample
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.sample()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        now = time.monotonic()
+        usage = tree_usage(self.pid)
+        if usage is None:
+            return
+        self.samples += 1
+        if self.last is not None and now > self.last[0]:
+            ticks = max(0, usage['cpu_ticks'] - self.last[1])
+            cpu_percent = ticks / CLOCK_TICKS / (now - self.last[0]) * 100
+            self.peaks['cpu_percent'] = max(self.peaks['cpu_percent'], round(cpu_percent, 1))
+        self.last = (now, usage['cpu_ticks'])
+        for name in ('rss', 'fds', 'threads'):
+            self.peaks[name] = max(self.peaks[name], usage[name])
+
+    def stop(self):
+        """
+        Stop sampling, after a last sample
+
+        Returns:
+            dict: Peaks with the number of samples, None if no sample was taken
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.sample()
+        if not self.samples:
+            return None
+        return dict(self.peaks, samples=self.samples)
+
+
+def format_size(size):
+    for unit in ('B', 'K', 'M'):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}G"
+
+
+def check_limits(limits, peaks):
+    """
+    Compare the peaks of a monitored service with the limits of a test case
+
+    Args:
+        limits (dict): rss (bytes), fds and threads, see TestCase.limits
+        peaks (dict): Result of Monitor.stop(), may be None
+
+    Returns:
+        str: Description of the first exceeded limit, None if within all of them
+    """
+    if not limits:
+        return None
+    if peaks is None:
+        return "resource limits set but the web.command was not monitored"
+    for name, limit in limits.items():
+        if peaks[name] > limit:
+            if name == 'rss':
+                return f"max_rss {format_size(peaks[name])} exceeds {format_size(limit)}"
+            return f"max_{name} {peaks[name]} exceeds {limit}"
+    return None
@@ -0,0 +1,130 @@
+import contextlib
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import base
+import parser
+
+
+def parser_digest():
+    """Hash of the parser sources, a changed parser invalidates every entry"""
+    digest = hashlib.sha1()
+    for module in (base, parser):
+        with open(module.__file__, 'rb') as fp:
+            digest.update(fp.read())
+    return digest.hexdigest()
+
+
+def file_digest(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ParseCache(object):
+    """
+    Pickled test cases of .t files, stored one entry per file
+
+    An entry is a header (parser version, mtime, size and content hash of the
+    file) followed by one pickle per test case, so entries are written and
+    read back one test case at a time. An entry is used when the mtime and
+    size of the file are unchanged, or when they changed but the content hash
+    did not (e.g. after a checkout). Any other change makes the file be
+    parsed again.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.version = parser_digest()
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, file_path):
+        key = hashlib.sha1(os.path.abspath(file_path).encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.pickle")
+
+    def header(self, stat, digest):
+        return {'version': self.version, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'digest': digest}
+
+    def open_entry(self, file_path):
+        """
+        Open the entry of a file if it is still valid
+
+        Args:
+            file_path (str): Path of the .t file
+
+        Returns:
+            file: Entry positioned at its first test case, None if missing or stale
+        """
+        try:
+            fp = open(self.entry_path(file_path), 'rb')
+        except OSError:
+            return None
+        try:
+            header = pickle.load(fp)
+            if header.get('version') != self.version:
+                fp.close()
+                return None
+            stat = os.stat(file_path)
+            if header['mtime_ns'] == stat.st_mtime_ns and header['size'] == stat.st_size:
+                return fp
+            if header['size'] != stat.st_size or header['digest'] != file_digest(file_path):
+                fp.close()
+                return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, KeyError):
+            fp.close()
+            return None
+
+        # Touched but unchanged, remember the new mtime to skip hashing next time
+        with fp:
+            with self.writer() as (out, tmp_path):
+                pickle.dump(self.header(stat, header['digest']), out)
+                shutil.copyfileobj(fp, out)
+            os.replace(tmp_path, self.entry_path(file_path))
+        return self.open_entry(file_path)
+
+    @contextlib.contextmanager
+    def writer(self):
+        """Temporary entry file, concurrent runs never see a partial entry"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                yield fp, tmp_path
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def parse(self, file_path, parse_file):
+        """
+        Yield the test cases of a file, from the cache when possible
+
+        Args:
+            file_path (str): Path of the .t file
+            parse_file (callable): Yields the test cases of a file when it is not cached
+
+        Yields:
+            TestCase: Test cases in file order
+        """
+        fp = self.open_entry(file_path)
+        if fp is not None:
+            with fp:
+                while True:
+                    try:
+                        yield pickle.load(fp)
+                    except EOFError:
+                        return
+
+        # Stat and hash before parsing, an edit during parsing leaves a stale
+        # entry that the next run detects
+        stat = os.stat(file_path)
+        digest = file_digest(file_path)
+        with self.writer() as (out, tmp_path):
+            pickle.dump(self.header(stat, digest), out)
+            for test_case in parse_file(file_path):
+                # Pickled before the runner gets to modify it
+                pickle.dump(test_case, out, protocol=pickle.HIGHEST_PROTOCOL)
+                yield test_case
+        os.replace(tmp_path, self.entry_path(file_path))
@@ -1,4 +1,10 @@
-from base import TestCase, TestRequest, TestResponse, Env, Web
+import hashlib
+import re
+import textwrap
+from base import TestCase, TestRequest, TestResponse, Env, Web, Ready, RepeatedBody, Performance, StubRoute, Step, Capture
+
+REPEAT_EXPR = re.compile(r'^"(.*)"\s*x\s*(\d+)$')
+TAG_EXPR = re.compile(r'(?:^|\s)@([\w.-]+)')
 
 def parse_response_body(content):
     """
@@ -13,20 +19,14 @@ def parse_response_body(content):
     content = content.strip()
     if content.startswith('eval'):
         # Extract the eval expression
-        eval_expr = content.replace('eval', '').strip()
+        eval_expr = content[len('eval'):].strip()
+        # Repetition, "a" x 4096, is generated lazily when the body is compared
+        match = REPEAT_EXPR.match(eval_expr)
+        if match:
+            return (RepeatedBody(match.group(1), int(match.group(2))), content)
         # Handle quoted strings
         if eval_expr.startswith('"') and eval_expr.endswith('"'):
             eval_expr = eval_expr[1:-1]
-        # Parse the multiplication if present
-        if 'x' in eval_expr:
-            parts = eval_expr.split('x')
-            if len(parts) == 2:
-                try:
-                    char = parts[0].strip()
-                    count = int(parts[1].strip())
-                    return (char * count, content)
-                except ValueError:
-                    return (eval_expr, content)
         return (eval_expr, content)
     return (content, None)
 
@@ -43,12 +43,12 @@ def parse_response(content):
             
         # Parse response body and eval expressions
         if line.startswith('body'):
-            body_content = line.replace('body', '').strip()
+            body_content = line[len('body'):].strip()
             response.body, response.eval_expr = parse_response_body(body_content)
             
         # Parse status code
         elif line.startswith('status'):
-            status = line.replace('status', '').strip()
+            status = line[len('status'):].strip()
             try:
                 response.status_code = int(status)
             except ValueError:
@@ -63,9 +63,28 @@ def parse_response(content):
 
 
 def parse_request(content):
+    """
+    Parse a request section: request line, header lines, blank line, body
+
+    Args:
+        content (str): Request content, e.g. "POST /t\nContent-Type: text/plain\n\nhello"
+
+    Returns:
+        TestRequest: Parsed request
+    """
     request = TestRequest()
-    request.method = content.split(' ')[0]
-    request.url = content.split(' ')[1]
+    lines = content.split('\n')
+    request_line = lines[0].split()
+    request.method = request_line[0].upper()
+    request.url = request_line[1]
+
+    for index, line in enumerate(lines[1:], 1):
+        line = line.strip()
+        if not line:
+            request.body = textwrap.dedent('\n'.join(lines[index + 1:])).strip()
+            break
+        header_name, _, header_value = line.partition(':')
+        request.headers[header_name.strip()] = header_value.strip()
     return request
 
 
@@ -76,6 +95,142 @@ def parse_request(content):
 #     return response
 
 
+def parse_stub_route(content):
+    """
+    Parse one route of a stub section
+
+    The first line is the method and path, optionally followed by the
+    status. The other lines are those of a response section, plus
+    "delay <duration>" and "chunked [chunk size]".
+    """
+    route = StubRoute()
+    lines = content.split('\n')
+    parts = lines[0].split()
+    route.method = parts[0].upper()
+    route.path = parts[1].partition('?')[0] if len(parts) > 1 else '/'
+    response_lines = []
+    for line in lines[1:]:
+        stripped = line.strip()
+        if stripped.startswith('delay '):
+            route.delay = parse_duration(stripped[len('delay'):])
+        elif stripped == 'chunked' or stripped.startswith('chunked '):
+            size = stripped[len('chunked'):].strip()
+            route.chunk_size = parse_size(size) if size else 4096
+        else:
+            response_lines.append(line)
+    route.response = parse_response('\n'.join(response_lines))
+    if route.response.body is None:
+        route.response.body = ""
+    if len(parts) > 2:
+        route.response.status_code = int(parts[2])
+    if not route.response.status_code:
+        route.response.status_code = 200
+    return route
+
+def parse_stub(content):
+    """Parse a stub section, routes are separated by blank lines"""
+    routes = []
+    block = []
+    for line in content.split('\n') + ['']:
+        if line.strip():
+            block.append(line)
+        elif block:
+            routes.append(parse_stub_route('\n'.join(block)))
+            block = []
+    return routes
+
+def parse_matrix(content):
+    """
+    Parse an inline table of variables, one row per line
+
+        id | name  | status
+        1  | alice | 200
+
+    Returns:
+        list: One dict per row, keyed by the names of the header line
+    """
+    lines = [line for line in content.split('\n') if line.strip()]
+    if not lines:
+        return []
+    names = [name.strip() for name in lines[0].strip().strip('|').split('|')]
+    rows = []
+    for line in lines[1:]:
+        values = [value.strip() for value in line.strip().strip('|').split('|')]
+        # Separator line under the header, e.g. ---|---
+        if all(value and set(value) <= set('-: ') for value in values):
+            continue
+        rows.append(dict(zip(names, values)))
+    return rows
+
+JSON_PATH_EXPR = re.compile(r"""\.([^.\[\]]+)|\[(-?\d+)\]|\[(['"])(.*?)\3\]""")
+
+
+def parse_json_path(content):
+    """
+    Parse the JSONPath subset of captures: $, .key, ['key'] and [index]
+
+    Returns:
+        list: Keys (str) and indexes (int) from the root of the document
+    """
+    content = content.strip()
+    if not content.startswith('$'):
+        raise ValueError(f"invalid JSONPath: {content}")
+    path = []
+    position = 1
+    while position < len(content):
+        match = JSON_PATH_EXPR.match(content, position)
+        if match is None:
+            raise ValueError(f"invalid JSONPath: {content}")
+        key, index, _, quoted = match.groups()
+        if index is not None:
+            path.append(int(index))
+        else:
+            path.append(key if key is not None else quoted)
+        position = match.end()
+    return path
+
+def parse_pattern(content):
+    """Regular expression between slashes, e.g. /id=(\\d+)/"""
+    content = content.strip()
+    if len(content) < 2 or not content.startswith('/') or not content.endswith('/'):
+        raise ValueError(f"invalid capture pattern: {content}")
+    return re.compile(content[1:-1])
+
+def parse_capture(content):
+    """
+    Parse a capture section, one variable per line
+
+        TOKEN = $.auth.token
+        ID = /"id":\\s*(\\d+)/
+        LOCATION = header Location
+        ITEM = header Location /items\\/(\\d+)/
+
+    Returns:
+        list: Capture objects in the order of the lines
+    """
+    captures = []
+    for line in content.split('\n'):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        name, separator, expression = line.partition('=')
+        if not separator:
+            raise ValueError(f"invalid capture: {line}")
+        capture = Capture()
+        capture.name = name.strip()
+        expression = expression.strip()
+        if expression.startswith('header '):
+            header, _, pattern = expression[len('header'):].strip().partition(' ')
+            capture.header = header
+            if pattern.strip():
+                capture.pattern = parse_pattern(pattern)
+        elif expression.startswith('$'):
+            capture.path = parse_json_path(expression)
+        else:
+            capture.pattern = parse_pattern(expression)
+        captures.append(capture)
+    return captures
+
 def parse_error_code(content):
     """
     Parse error code, handling chomp modifier
@@ -124,69 +279,259 @@ def parse_web(content):
     for line in lines:
         line = line.strip()
         line = line.split('=', 1)
-        print('-----web--------', line)
         if len(line) == 2:
             if line[0].strip() == 'command':
                 commands = line[1].strip().split(' ', 1)
-                print('-----web--------', commands)
                 web.command = commands[0]
                 web.args = commands[1].split(' ')
     
     return web
 
-def parse_test(test_content):
+def parse_duration(content):
     """
-    Parse test case content into a structured format.
-    
+    Parse a duration such as 50ms, 10s or 2m
+
     Args:
-        test_content (str): Raw test case content
-        
+        content (str): Duration, a bare number is taken as seconds
+
+    Returns:
+        float: Duration in seconds
+    """
+    content = content.strip()
+    for suffix, scale in (('ms', 0.001), ('s', 1), ('m', 60)):
+        if content.endswith(suffix):
+            return float(content[:-len(suffix)].strip()) * scale
+    return float(content)
+
+def parse_size(content):
+    """
+    Args:
+        content (str): Size with an optional K, M or G suffix (powers of 1024), e.g. 200M
+
+    Returns:
+        int: Size in bytes
+    """
+    content = content.strip().upper()
+    for suffix in ('IB', 'B'):
+        if content.endswith(suffix) and content[:-len(suffix)][-1:] in ('K', 'M', 'G'):
+            content = content[:-len(suffix)]
+            break
+    for suffix, scale in (('K', 1 << 10), ('M', 1 << 20), ('G', 1 << 30)):
+        if content.endswith(suffix):
+            return int(float(content[:-1].strip()) * scale)
+    return int(content)
+
+TIMEOUT_PHASES = ('test', 'setup', 'request')
+
+
+def parse_timeout(content):
+    """
+    Parse a timeout section, a bare duration is the timeout of the whole test
+
+        10s
+        setup 5s
+        request 500ms
+
     Returns:
-        TestCase: Parsed test case object
+        dict: Seconds per phase, see TIMEOUT_PHASES
     """
-    test_case = TestCase()
+    timeouts = {}
+    for line in content.split('\n'):
+        parts = line.split()
+        if not parts:
+            continue
+        phase, duration = ('test', parts[0]) if len(parts) == 1 else (parts[0], parts[1])
+        if phase not in TIMEOUT_PHASES:
+            raise ValueError(f"unknown timeout phase: {phase}")
+        timeouts[phase] = parse_duration(duration)
+    return timeouts
+
+def parse_max_latency(content):
+    """
+    Args:
+        content (str): Duration with an optional percentile first, e.g. "p95 20ms", p99 by default
+
+    Returns:
+        tuple: (percentile, seconds)
+    """
+    parts = content.split()
+    percentile = 99.0
+    if len(parts) == 2 and parts[0].lower().startswith('p'):
+        percentile = float(parts[0][1:])
+        parts = parts[1:]
+    if len(parts) != 1 or not 0 < percentile <= 100:
+        raise ValueError(f"invalid max_latency: {content}")
+    return percentile, parse_duration(parts[0])
+
+def parse_ready(content):
+    ready = Ready()
+    lines = content.split('\n')
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        kind, _, target = line.partition(' ')
+        target = target.strip()
+        if kind == 'timeout':
+            ready.timeout = parse_duration(target)
+        elif kind == 'interval':
+            ready.interval = parse_duration(target)
+        else:
+            ready.probes.append((kind, target))
+    return ready
+
+def parse_header(line):
+    """
+    Title and tags of a "=== TEST" header line
+
+    Tags are the words starting with @, e.g. "=== TEST 1: login @auth @slow".
+
+    Returns:
+        tuple: (title, tags), the title without the tags
+    """
+    header = line.replace('=== TEST', '', 1)
+    tags = TAG_EXPR.findall(header)
+    if tags:
+        header = TAG_EXPR.sub('', header)
+    return header.strip(), tags
+
+
+STEP_SECTIONS = {'request': 'request_source', 'response_body': 'response_source', 'capture': 'captures'}
+
+
+def current_step(test_case, section):
+    """
+    Step a request, response_body or capture section belongs to
+
+    A section starts a new step when the last step already has one of its kind.
+    """
+    if not test_case.steps or getattr(test_case.steps[-1], STEP_SECTIONS[section]):
+        test_case.steps.append(Step())
+    return test_case.steps[-1]
+
+def finish_section(test_case, current_section, section_content):
+    """Store the buffered content of a section on the test case, a malformed one only fails the test case"""
+    try:
+        store_section(test_case, current_section, section_content)
+    except (ValueError, IndexError, re.error) as e:
+        if test_case.parse_error is None:
+            test_case.parse_error = f"invalid {current_section} section: {e}"
+
+def store_section(test_case, current_section, section_content):
+    if current_section == 'description':
+        test_case.description = '\n'.join(section_content).strip()
+    elif current_section == 'mysql_config':
+        test_case.mysql_config = '\n'.join(section_content).strip()
+    elif current_section == 'init_sql':
+        test_case.init_sql = '\n'.join(section_content).strip()
+    elif current_section == 'config':
+        test_case.config = '\n'.join(section_content).strip()
+    elif current_section == 'docker_compose_config':
+        test_case.docker_compose_config = '\n'.join(section_content).strip()
+    elif current_section == 'request':
+        step = current_step(test_case, current_section)
+        step.request_source = '\n'.join(section_content).strip()
+        step.request = parse_request(step.request_source)
+        if step is test_case.steps[0]:
+            test_case.request = step.request
+    elif current_section == 'response_body':
+        response_content = '\n'.join(section_content).strip()
+        step = current_step(test_case, current_section)
+        step.response_source = response_content
+        step.response_body = response_content
+        step.response = parse_response(response_content)
+        if step is test_case.steps[0]:
+            # test_case.response_body, test_case.response_body_eval = parse_response_body(response_content)
+            test_case.response_body = response_content
+            test_case.response = step.response
+    elif current_section == 'capture':
+        current_step(test_case, current_section).captures = parse_capture('\n'.join(section_content))
+    elif current_section == 'env':
+        env_content = '\n'.join(section_content).strip()
+        env = parse_env(env_content)
+        test_case.env = env
+    elif current_section == 'web':
+        web_content = '\n'.join(section_content).strip()
+        test_case.web = parse_web(web_content)
+    elif current_section == 'ready':
+        test_case.ready = parse_ready('\n'.join(section_content).strip())
+    elif current_section == 'max_rss':
+        test_case.limits['rss'] = parse_size('\n'.join(section_content))
+    elif current_section in ('max_fds', 'max_threads'):
+        test_case.limits[current_section[len('max_'):]] = int('\n'.join(section_content).strip())
+    elif current_section == 'timeout':
+        test_case.timeouts.update(parse_timeout('\n'.join(section_content)))
+    elif current_section == 'matrix':
+        test_case.matrix = parse_matrix('\n'.join(section_content))
+    elif current_section == 'data_file':
+        test_case.data_file = '\n'.join(section_content).strip()
+    elif current_section == 'stub':
+        test_case.stub = parse_stub('\n'.join(section_content).strip())
+    elif current_section in ('max_latency', 'repeat', 'concurrency', 'min_rps'):
+        if test_case.performance is None:
+            test_case.performance = Performance()
+        content = '\n'.join(section_content).strip()
+        if current_section == 'max_latency':
+            test_case.performance.max_latency.append(parse_max_latency(content))
+        elif current_section == 'min_rps':
+            test_case.performance.min_rps = float(content)
+        else:
+            setattr(test_case.performance, current_section, max(1, int(content)))
+
+
+def parse_tests(lines):
+    """
+    Parse test blocks one line at a time.
+
+    Every "=== TEST" header starts a new TestCase, which is yielded as soon
+    as the next header (or the end of the input) is reached, so only one
+    block is held in memory at a time.
+
+    Args:
+        lines (iterable): Lines of a test file, e.g. an open file object
+
+    Yields:
+        TestCase: Parsed test case objects in file order
+    """
+    test_case = None
     current_section = None
-    lines = test_content.split('\n')
-    
+
     # Buffer to store multi-line content
     section_content = []
-    
+
+    # Hash of the raw lines of the current block
+    digest = hashlib.sha1()
+
     for line in lines:
+        line = line.rstrip('\r\n')
+
         # Handle section headers
         if line.startswith('#'): 
             continue
 
         if line.startswith('=== TEST'):
-            test_case.title = line.replace('=== TEST', '').strip()
+            if test_case is not None:
+                finish_section(test_case, current_section, section_content)
+                test_case.digest = digest.hexdigest()
+                yield test_case
+            digest = hashlib.sha1()
+            digest.update(line.encode() + b'\n')
+            test_case = TestCase()
+            test_case.title, test_case.tags = parse_header(line)
             current_section = 'description'
+            section_content = []
             continue
-            
+
+        digest.update(line.encode() + b'\n')
+
         if line.startswith('--- '):
+            # Sections before the first header belong to an untitled test case
+            if test_case is None:
+                test_case = TestCase()
+
             # Save content from previous section
-            if current_section == 'description':
-                test_case.description = '\n'.join(section_content).strip()
-            elif current_section == 'mysql_config':
-                test_case.mysql_config = '\n'.join(section_content).strip()
-            elif current_section == 'init_sql':
-                test_case.init_sql = '\n'.join(section_content).strip()
-            elif current_section == 'config':
-                test_case.config = '\n'.join(section_content).strip()
-            elif current_section == 'docker_compose_config':
-                test_case.docker_compose_config = '\n'.join(section_content).strip()
-            elif current_section == 'request':
-                test_case.request = parse_request('\n'.join(section_content).strip())
-            elif current_section == 'response_body':
-                response_content = '\n'.join(section_content).strip()
-                # test_case.response_body, test_case.response_body_eval = parse_response_body(response_content)
-                test_case.response = parse_response(response_content)
-            elif current_section == 'env':
-                env_content = '\n'.join(section_content).strip()
-                env = parse_env(env_content)
-                test_case.env = env
-            elif current_section == 'web':
-                web_content = '\n'.join(section_content).strip()
-                test_case.web = parse_web(web_content)
-                
+            finish_section(test_case, current_section, section_content)
+
             # Clear buffer and set new section
             section_content = []
             
@@ -196,20 +541,34 @@ def parse_test(test_content):
                 test_case.error_code, test_case.error_code_chomp = parse_error_code(error_content)
                 current_section = None
             else:
-                current_section = line.replace('---', '').strip()
+                # Text after the section name, e.g. "--- max_rss 200M", is its first line
+                current_section, _, inline = line.replace('---', '', 1).strip().partition(' ')
+                if inline.strip():
+                    section_content.append(inline.strip())
             continue
             
         # Accumulate content for current section
         if current_section:
             section_content.append(line)
-            
-    # Handle last section if needed
-    if current_section and section_content:
-        if current_section == 'response_body':
-            response_content = '\n'.join(section_content).strip()
-            test_case.response_body, test_case.response_body_eval = parse_response_body(response_content)
-            
-    return test_case
+
+    # Handle last section
+    if test_case is not None:
+        finish_section(test_case, current_section, section_content)
+        test_case.digest = digest.hexdigest()
+        yield test_case
+
+
+def parse_test(test_content):
+    """
+    Parse test case content into a structured format.
+    
+    Args:
+        test_content (str): Raw test case content
+        
+    Returns:
+        TestCase: The first test case of the content, see parse_tests for all of them
+    """
+    return next(parse_tests(test_content.split('\n')), TestCase())
 
 # Example usage and testing
 def print_test_case(test_case):
@@ -0,0 +1,258 @@
+import asyncio
+import os
+import re
+import socket
+import subprocess
+import time
+from urllib.parse import urlparse
+import requests
+
+
+class ReadyError(Exception):
+    pass
+
+
+class TcpProbe(object):
+    """Ready once a TCP connection to host:port is accepted"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def __str__(self):
+        return f"tcp {self.host}:{self.port}"
+
+    def check(self):
+        try:
+            with socket.create_connection((self.host, self.port), timeout=0.5):
+                return True
+        except OSError:
+            return False
+
+    async def check_async(self):
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), 0.5)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+
+
+class UnixSocketProbe(object):
+    """Ready once a connection to the unix socket at path is accepted"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return f"unix {self.path}"
+
+    def check(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(0.5)
+            try:
+                sock.connect(self.path)
+                return True
+            except OSError:
+                return False
+
+    async def check_async(self):
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.path), 0.5)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+
+
+class HttpProbe(object):
+    """Ready once GET url answers with anything but a server error"""
+
+    def __init__(self, url):
+        self.url = url
+
+    def __str__(self):
+        return f"http {self.url}"
+
+    def check(self):
+        try:
+            return requests.get(self.url, timeout=1).status_code < 500
+        except requests.RequestException:
+            return False
+
+    async def check_async(self):
+        # aiohttp is only needed by the asyncio engine
+        import aiohttp
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1)) as session:
+                async with session.get(self.url) as resp:
+                    return resp.status < 500
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+
+class LogProbe(object):
+    """Ready once a line of the log file matches pattern"""
+
+    def __init__(self, path, pattern):
+        self.path = path
+        self.pattern = re.compile(pattern)
+        self.offset = 0
+        self.pending = ''
+
+    def __str__(self):
+        return f"log {self.pattern.pattern}"
+
+    def check(self):
+        try:
+            with open(self.path, 'r', errors='replace') as fp:
+                fp.seek(self.offset)
+                content = fp.read()
+                self.offset = fp.tell()
+        except FileNotFoundError:
+            return False
+
+        # Only complete lines are matched, the unterminated tail is kept for
+        # the next check
+        lines = (self.pending + content).split('\n')
+        self.pending = lines.pop()
+        return any(self.pattern.search(line) for line in lines)
+
+    async def check_async(self):
+        # Reads what was appended since the last check, too little to block the loop
+        return self.check()
+
+
+class CommandProbe(object):
+    """Ready once the command exits with status 0"""
+
+    def __init__(self, args, cwd=None):
+        self.args = args
+        self.cwd = cwd
+
+    def __str__(self):
+        return f"command {' '.join(self.args)}"
+
+    def check(self):
+        try:
+            return subprocess.run(self.args, cwd=self.cwd, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL).returncode == 0
+        except OSError:
+            return False
+
+    async def check_async(self):
+        try:
+            process = await asyncio.create_subprocess_exec(*self.args, cwd=self.cwd, stdout=subprocess.DEVNULL,
+                                                           stderr=subprocess.DEVNULL)
+        except OSError:
+            return False
+        return await process.wait() == 0
+
+
+def default_probe(prefix):
+    """TCP probe on the host and port of the prefix"""
+    url = urlparse(prefix)
+    port = url.port or (443 if url.scheme == 'https' else 80)
+    return TcpProbe(url.hostname or '127.0.0.1', port)
+
+
+def build_probe(kind, target, prefix, cwd):
+    """
+    Create a probe from a line of the ready section
+
+    Args:
+        kind (str): One of tcp, http, log, unix
+        target (str): Rendered probe target
+        prefix (str): Prefix of the api test, relative http paths are joined to it
+        cwd (str): Folder of the test case holding web.log
+
+    Returns:
+        object: Probe with check() and check_async() methods
+    """
+    if kind == 'tcp':
+        host, _, port = target.rpartition(':')
+        return TcpProbe(host or '127.0.0.1', int(port))
+    if kind == 'http':
+        if target.startswith('/'):
+            target = prefix + target
+        return HttpProbe(target)
+    if kind == 'log':
+        return LogProbe(os.path.join(cwd, 'web.log'), target)
+    if kind == 'unix':
+        return UnixSocketProbe(os.path.join(cwd, target))
+    raise ReadyError(f"unknown ready probe: {kind}")
+
+
+def wait_ready(probes, timeout=30.0, interval=0.05, max_interval=1.0, process=None):
+    """
+    Wait until every probe succeeded, backing off exponentially between rounds
+
+    Args:
+        probes (list): Probes with a check() method
+        timeout (float): Overall timeout in seconds
+        interval (float): Delay after the first failed round, doubled every round
+        max_interval (float): Upper bound of the delay
+        process (SupervisedProcess): Service being probed, waiting stops if it exits
+
+    Returns:
+        float: Seconds spent waiting
+
+    Raises:
+        ReadyError: If the timeout expired or the process exited
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    pending = list(probes)
+    while True:
+        pending = [probe for probe in pending if not probe.check()]
+        if not pending:
+            return time.monotonic() - start
+
+        if process is not None and not process.is_alive():
+            raise ReadyError(f"process exited before ready: {', '.join(str(p) for p in pending)} "
+                             f"({process.describe_exit()})")
+
+        now = time.monotonic()
+        if now >= deadline:
+            raise ReadyError(f"not ready after {timeout}s: {', '.join(str(p) for p in pending)}")
+
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * 2, max_interval)
+
+
+async def wait_ready_async(probes, timeout=30.0, interval=0.05, max_interval=1.0, process=None):
+    """
+    Asyncio flavour of wait_ready, probes are checked concurrently on the event loop
+
+    Args:
+        probes (list): Probes with a check_async() method
+        timeout (float): Overall timeout in seconds
+        interval (float): Delay after the first failed round, doubled every round
+        max_interval (float): Upper bound of the delay
+        process (SupervisedProcess): Service being probed, waiting stops if it exits
+
+    Returns:
+        float: Seconds spent waiting
+
+    Raises:
+        ReadyError: If the timeout expired or the process exited
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    pending = list(probes)
+    while True:
+        results = await asyncio.gather(*[probe.check_async() for probe in pending])
+        pending = [probe for probe, ok in zip(pending, results) if not ok]
+        if not pending:
+            return time.monotonic() - start
+
+        if process is not None and not process.is_alive():
+            raise ReadyError(f"process exited before ready: {', '.join(str(p) for p in pending)} "
+                             f"({process.describe_exit()})")
+
+        now = time.monotonic()
+        if now >= deadline:
+            raise ReadyError(f"not ready after {timeout}s: {', '.join(str(p) for p in pending)}")
+
+        await asyncio.sleep(min(interval, deadline - now))
+        interval = min(interval * 2, max_interval)
@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import tempfile
+import threading
+import aiohttp
+from aiohttp import web
+from yarl import URL
+from compare import CHUNK_SIZE
+from stub import StubServer
+
+NAMESPACE_PREFIX = '/_replay/'
+
+# Responses recorded per request key, later occurrences replay the last one
+MAX_OCCURRENCES = 16
+
+# Headers describing the connection rather than the response, not forwarded nor recorded
+HOP_HEADERS = frozenset(['connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+                         'transfer-encoding', 'upgrade', 'host', 'content-length'])
+
+
+def replay_id(test_case, directory):
+    """Identity of a test case in a replay store, relative to the test directory so stores can be moved"""
+    path = os.path.relpath(os.path.abspath(test_case.file or ''), os.path.abspath(directory))
+    return f"{path}:{test_case.index}"
+
+
+def request_key(test_id, method, path, body):
+    """Key of a request in a replay store, path is relative to the prefix and includes the query string"""
+    digest = hashlib.sha1()
+    for part in (test_id.encode(), method.encode(), path.encode(), body):
+        digest.update(part + b'\0')
+    return digest.hexdigest()
+
+
+def forwarded_headers(headers):
+    return [(name, value) for name, value in headers.items() if name.lower() not in HOP_HEADERS]
+
+
+class ReplayStore(object):
+    """
+    Responses of upstream services recorded on disk
+
+    The store is a directory with two files: responses.dat, the bodies one
+    after the other, and index.json, mapping every request key to the
+    responses recorded for its occurrences as [status, headers, offset,
+    length]. Replaying loads the index only, the bodies are memory-mapped
+    and sliced on demand so large ones are never read as a whole. Recording
+    appends to the data file; the responses recorded for a key replace
+    those of earlier runs once close() wrote the index, compacting the data
+    file first when replaced bodies take up most of it.
+    """
+
+    def __init__(self, directory, recording=False):
+        self.directory = directory
+        self.recording = recording
+        self.index = {}
+        self.recorded = set()  # Keys recorded by this run
+        self.data = None
+        self.view = None
+        self.lock = threading.Lock()
+        index_path = os.path.join(directory, 'index.json')
+        if os.path.exists(index_path):
+            with open(index_path) as fp:
+                self.index = json.load(fp)
+        elif not recording:
+            raise OSError(f"no recorded responses in {directory}")
+
+        if recording:
+            os.makedirs(directory, exist_ok=True)
+            self.data = open(self.data_path, 'ab')
+        else:
+            self.data = open(self.data_path, 'rb')
+            if os.fstat(self.data.fileno()).st_size:
+                self.view = mmap.mmap(self.data.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def data_path(self):
+        return os.path.join(self.directory, 'responses.dat')
+
+    def add(self, key, occurrence, status, headers, body):
+        """
+        Record the response to an occurrence of a request
+
+        Args:
+            headers (list): (name, value) pairs
+            body (file): Whole body, read from its current position
+        """
+        if occurrence >= MAX_OCCURRENCES:
+            return
+        with self.lock:
+            offset = self.data.seek(0, os.SEEK_END)
+            length = 0
+            for chunk in iter(lambda: body.read(CHUNK_SIZE), b''):
+                self.data.write(chunk)
+                length += len(chunk)
+            if key not in self.recorded:
+                self.recorded.add(key)
+                self.index[key] = []
+            entries = self.index[key]
+            entries.extend([None] * (occurrence + 1 - len(entries)))
+            entries[occurrence] = [status, headers, offset, length]
+
+    def get(self, key, occurrence):
+        """
+        Returns:
+            list: [status, headers, offset, length] of the response, None if nothing was recorded
+        """
+        entries = self.index.get(key)
+        if not entries:
+            return None
+        return entries[min(occurrence, len(entries) - 1)]
+
+    def body_chunks(self, offset, length, chunk_size=CHUNK_SIZE):
+        """Recorded body in chunks, sliced from the memory-mapped data file"""
+        for start in range(offset, offset + length, chunk_size):
+            yield self.view[start:min(start + chunk_size, offset + length)]
+
+    def compact(self):
+        """Rewrite the data file without the bodies of replaced responses once they take up most of it"""
+        entries = [entry for key in self.index for entry in self.index[key] if entry is not None]
+        if os.path.getsize(self.data_path) <= 2 * sum(entry[3] for entry in entries):
+            return
+        fd, temporary = tempfile.mkstemp(dir=self.directory)
+        with open(self.data_path, 'rb') as source, os.fdopen(fd, 'wb') as target:
+            for entry in sorted(entries, key=lambda entry: entry[2]):
+                source.seek(entry[2])
+                entry[2] = target.tell()
+                for length in range(entry[3], 0, -CHUNK_SIZE):
+                    target.write(source.read(min(CHUNK_SIZE, length)))
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, self.data_path)
+
+    def close(self):
+        if self.data.closed:
+            return
+        if self.recording:
+            self.data.close()
+            self.compact()
+            # Replaced at once, an interrupted run leaves the previous index
+            fd, temporary = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(self.index, fp, separators=(',', ':'))
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, os.path.join(self.directory, 'index.json'))
+        else:
+            if self.view is not None:
+                self.view.close()
+            self.data.close()
+
+
+class Attachment(object):
+    """Requests of one running test case to the replay server"""
+
+    def __init__(self, test_id, upstream):
+        self.test_id = test_id
+        self.upstream = upstream  # Prefix requests are forwarded to when recording
+        self.occurrences = {}  # Request key -> requests seen so far
+
+
+class ReplayServer(StubServer):
+    """
+    Local HTTP server recording or replaying the responses of upstream services
+
+    Every running test case is attached below its own namespace,
+    /_replay/<id>, and sends its requests there instead of to its prefix.
+    When recording, requests are forwarded to the prefix and the responses
+    added to the store, then sent back. When replaying they
+    are answered from the store, so neither fixtures nor the web.command
+    need to run. The nth identical request of a test case gets the nth
+    recorded response.
+    """
+
+    def __init__(self, store, host='127.0.0.1', port=0):
+        super().__init__(host, port)
+        self.store = store
+        self.attachments = {}  # Namespace -> Attachment
+        self.counter = itertools.count()
+        self.client = None
+
+    async def serve(self):
+        await super().serve()
+        if self.store.recording:
+            # Bodies are recorded as sent, e.g. still gzipped
+            self.client = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), auto_decompress=False,
+                                                timeout=aiohttp.ClientTimeout(total=None))
+
+    async def shutdown(self):
+        if self.client is not None:
+            await self.client.close()
+        await super().shutdown()
+
+    def attach(self, test_id, upstream):
+        """
+        Returns:
+            str: Prefix the test case is to send its requests to
+        """
+        namespace = f"{next(self.counter):x}"
+        self.attachments[namespace] = Attachment(test_id, upstream)
+        return f"{self.url}{NAMESPACE_PREFIX}{namespace}"
+
+    def detach(self, url):
+        self.attachments.pop(url.rpartition('/')[2], None)
+
+    async def handle(self, request):
+        raw_path = request.raw_path
+        if not raw_path.startswith(NAMESPACE_PREFIX):
+            return web.Response(status=404, text=f"not a replay path: {request.path}")
+        rest = raw_path[len(NAMESPACE_PREFIX):]
+        split = min((rest.find(c) for c in '/?' if c in rest), default=len(rest))
+        attachment = self.attachments.get(rest[:split])
+        if attachment is None:
+            return web.Response(status=404, text=f"no test case attached as {rest[:split]}")
+        path = rest[split:]
+
+        body = await request.read()
+        key = request_key(attachment.test_id, request.method, path, body)
+        occurrence = attachment.occurrences.get(key, 0)
+        attachment.occurrences[key] = occurrence + 1
+        if self.store.recording:
+            return await self.record(request, attachment.upstream + path, body, key, occurrence)
+        return await self.replay(request, path, key, occurrence)
+
+    async def record(self, request, url, body, key, occurrence):
+        recorded = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        try:
+            try:
+                async with self.client.request(request.method, URL(url, encoded=True),
+                                               headers=forwarded_headers(request.headers), data=body,
+                                               allow_redirects=False) as upstream:
+                    status = upstream.status
+                    headers = forwarded_headers(upstream.headers)
+                    async for chunk in upstream.content.iter_chunked(CHUNK_SIZE):
+                        recorded.write(chunk)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                return web.Response(status=502, text=f"upstream {url} failed: {str(e) or type(e).__name__}")
+            length = recorded.tell()
+            # Recorded before the client gets it, a client hanging up early must not lose the exchange.
+            # Large bodies are copied from disk, off the event loop
+            recorded.seek(0)
+            await asyncio.to_thread(self.store.add, key, occurrence, status, headers, recorded)
+            recorded.seek(0)
+            response = web.StreamResponse(status=status, headers=headers)
+            response.content_length = length
+            return await self.send(request, response, iter(lambda: recorded.read(CHUNK_SIZE), b''))
+        finally:
+            recorded.close()
+
+    async def replay(self, request, path, key, occurrence):
+        entry = self.store.get(key, occurrence)
+        if entry is None:
+            return web.Response(status=404, text=f"no recorded response for {request.method} {path}")
+        status, headers, offset, length = entry
+        response = web.StreamResponse(status=status, headers=[tuple(header) for header in headers])
+        response.content_length = length
+        return await self.send(request, response, self.store.body_chunks(offset, length))
+
+    async def send(self, request, response, chunks):
+        """Stream a response to the client, which may hang up before it got everything"""
+        try:
+            await response.prepare(request)
+            for chunk in chunks:
+                await response.write(chunk)
+            await response.write_eof()
+        except ConnectionResetError:
+            pass
+        return response
@@ -0,0 +1,121 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+
+class Reporter(object):
+    """Receives test results one at a time, as the test cases complete"""
+
+    def add(self, result):
+        pass
+
+    def close(self):
+        pass
+
+
+class ConsoleReporter(Reporter):
+    """One line per test case and a summary line at the end"""
+
+    LABELS = {'passed': 'PASS', 'failed': 'FAIL', 'error': 'ERROR', 'skipped': 'SKIP'}
+
+    def __init__(self):
+        self.counts = {}
+        self.start = time.monotonic()
+
+    def add(self, result):
+        self.counts[result.status] = self.counts.get(result.status, 0) + 1
+        line = f"{self.LABELS[result.status]}: {result.title} ({result.duration:.3f}s)"
+        if result.message:
+            line += f"\n    {result.message}"
+        if result.workspace and not result.passed:
+            line += f"\n    workspace: {result.workspace}"
+        # One write, lines printed by the workers meanwhile cannot split it
+        print(line + '\n', end='', flush=True)
+
+    def close(self):
+        summary = ', '.join(f"{count} {status}" for status, count in sorted(self.counts.items()))
+        print(f"\n{summary or 'no test cases'} in {time.monotonic() - self.start:.3f}s")
+
+
+class JsonLinesReporter(Reporter):
+    """A JSON object per test case, flushed as soon as it is written"""
+
+    def __init__(self, path):
+        self.fp = open(path, 'w')
+
+    def add(self, result):
+        self.fp.write(json.dumps(result.to_dict()) + '\n')
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+
+class JUnitReporter(Reporter):
+    """
+    JUnit XML report
+
+    Test case elements are streamed to a temporary file next to the report;
+    close() writes the testsuite element with the final counts and copies
+    them behind it, so results are never buffered in memory.
+    """
+
+    def __init__(self, path, name='api-test'):
+        self.path = path
+        self.name = name
+        self.counts = {'tests': 0, 'failures': 0, 'errors': 0, 'skipped': 0}
+        self.time = 0.0
+        fd, self.body_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.part')
+        self.body = os.fdopen(fd, 'w')
+
+    def add(self, result):
+        self.counts['tests'] += 1
+        self.time += result.duration
+        classname = os.path.splitext(os.path.basename(result.file or self.name))[0]
+        self.body.write(f'  <testcase classname={quoteattr(classname)} name={quoteattr(result.title)} '
+                        f'time="{result.duration:.6f}">\n')
+        if result.status == 'failed':
+            self.counts['failures'] += 1
+            self.body.write(f'    <failure message={quoteattr(result.message)}>{escape(result.message)}</failure>\n')
+        elif result.status == 'error':
+            self.counts['errors'] += 1
+            self.body.write(f'    <error message={quoteattr(result.message)}>{escape(result.message)}</error>\n')
+        elif result.status == 'skipped':
+            self.counts['skipped'] += 1
+            self.body.write(f'    <skipped message={quoteattr(result.message)}/>\n')
+        timings = ', '.join(f"{name}={value:.6f}s" for name, value in result.timings.items())
+        self.body.write(f'    <system-out>{escape(f"{result.request} -> {result.response}; {timings}")}</system-out>\n')
+        self.body.write('  </testcase>\n')
+        self.body.flush()
+
+    def close(self):
+        self.body.close()
+        with open(self.path, 'w') as fp:
+            fp.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            attributes = ' '.join(f'{key}="{value}"' for key, value in self.counts.items())
+            fp.write(f'<testsuite name={quoteattr(self.name)} {attributes} time="{self.time:.6f}">\n')
+            with open(self.body_path, 'r') as body:
+                shutil.copyfileobj(body, fp)
+            fp.write('</testsuite>\n')
+        os.unlink(self.body_path)
+
+
+class MultiReporter(Reporter):
+    """Hands every result to each of the reporters"""
+
+    def __init__(self, reporters):
+        self.reporters = reporters
+        self.failed = 0
+
+    def add(self, result):
+        if not result.passed:
+            self.failed += 1
+        for reporter in self.reporters:
+            reporter.add(result)
+
+    def close(self):
+        for reporter in self.reporters:
+            reporter.close()
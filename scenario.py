@@ -0,0 +1,104 @@
+import copy
+import json
+from parser import parse_request, parse_response
+from template import render
+
+
+class CaptureError(Exception):
+    pass
+
+
+def render_step(step, variables):
+    """Copy of a step with its request and response rendered with the variables"""
+    rendered = copy.copy(step)
+    rendered.request = parse_request(render(step.request_source, variables)) if step.request_source else ""
+    if step.response_source:
+        rendered.response_body = render(step.response_source, variables)
+        rendered.response = parse_response(rendered.response_body)
+    return rendered
+
+
+def step_case(test_case, step):
+    """
+    Shallow copy of a test case sending the request of a step
+
+    The copy shares the timings of the test case, so the spans of every
+    step add up in it.
+    """
+    case = copy.copy(test_case)
+    case.request = step.request
+    case.response_body = step.response_body
+    case.response = step.response
+    return case
+
+
+def render_case(test_case, variables):
+    """Copy of a test case sending its first step rendered with the variables, see render_step and step_case"""
+    return step_case(test_case, render_step(test_case.steps[0], variables))
+
+
+def describe_step(number, step):
+    request = step.request
+    return f"step {number} ({request.method} {request.url})" if request else f"step {number}"
+
+
+def json_value(document, path):
+    value = document
+    for key in path:
+        try:
+            value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return None, False
+    return value, True
+
+
+def capture_value(capture, headers, body):
+    """
+    Value of one capture in a response
+
+    Args:
+        headers: Response headers, a case-insensitive mapping
+        body (bytes): Whole response body
+
+    Returns:
+        str: Captured value, JSON values other than strings are serialized
+    """
+    if capture.header is not None:
+        text = headers.get(capture.header)
+        if text is None:
+            raise CaptureError(f"capture {capture.name}: no {capture.header} header")
+        source = f"{capture.header} header"
+    else:
+        text = body.decode('utf-8', 'replace')
+        source = "body"
+
+    if capture.path is not None:
+        try:
+            document = json.loads(text)
+        except ValueError:
+            raise CaptureError(f"capture {capture.name}: {source} is not JSON")
+        value, found = json_value(document, capture.path)
+        if not found:
+            raise CaptureError(f"capture {capture.name}: nothing at {format_path(capture.path)}")
+        return value if isinstance(value, str) else json.dumps(value)
+
+    if capture.pattern is not None:
+        match = capture.pattern.search(text)
+        if match is None:
+            raise CaptureError(f"capture {capture.name}: /{capture.pattern.pattern}/ not found in {source}")
+        return match.group(1) if capture.pattern.groups else match.group(0)
+    return text
+
+
+def format_path(path):
+    return '$' + ''.join(f"[{key}]" if isinstance(key, int) else f".{key}" for key in path)
+
+
+def capture_values(captures, headers, body):
+    """
+    Values of the captures of a step
+
+    Returns:
+        dict: Variable name to value
+    """
+    return {capture.name: capture_value(capture, headers, body) for capture in captures}
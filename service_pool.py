@@ -0,0 +1,127 @@
+import hashlib
+import os
+import threading
+from supervisor import SupervisedProcess
+from workspace import Workspaces
+
+
+class Service(object):
+    """A started web.command, kept running between test cases"""
+
+    def __init__(self, key, cwd, process, config_hash):
+        self.key = key  # (rendered command, rendered args)
+        self.cwd = cwd  # Workspace holding api.yaml and web.log of the service
+        self.process = process
+        self.config_hash = config_hash
+
+    def __str__(self):
+        return f"key: {self.key}, cwd: {self.cwd}, pid: {self.process.child_pid}"
+
+
+def confirms_reload(test_case):
+    """
+    Whether the ready section of a test case only succeeds once its service reloaded
+
+    The old process keeps listening, so TCP and HTTP probes pass at once. A
+    log probe only sees what is written after the reload, web.log is
+    truncated before the signal is sent.
+    """
+    return test_case.ready is not None and any(kind == 'log' for kind, _ in test_case.ready.probes)
+
+
+class ServicePool(object):
+    """
+    Warm web.command processes reused by consecutive test cases
+
+    The pool keeps one service per slot, the ${PORT} of the worker, which a
+    worker owns exclusively while it runs a test case, so a checked out
+    service is never shared. A test case gets the running service of its
+    slot when the rendered command and args are identical. If only its
+    config differs the new api.yaml is written and the service is sent
+    reload_signal, or restarted when there is none or the test case cannot
+    tell the reloaded service from the old one, see confirms_reload. Any other service of
+    the slot is stopped, it would hold the port. The workspace of a stopped
+    service is removed, unless it did not get ready.
+    """
+
+    STARTED = 'started'
+    RELOADED = 'reloaded'
+    REUSED = 'reused'
+
+    def __init__(self, workspaces=None, reload_signal=None):
+        self.workspaces = workspaces if workspaces is not None else Workspaces()
+        self.reload_signal = reload_signal
+        self.services = {}
+        self.lock = threading.Lock()
+
+    def checkout(self, test_case):
+        """
+        Get a running service for the web.command and config of a test case
+
+        Args:
+            test_case (TestCase): Test case with a config and web section, its PORT is the slot
+
+        Returns:
+            tuple: (Service, state), state is STARTED or RELOADED when the
+                   caller has to wait for the service to be ready
+        """
+        slot = test_case.env.env.get('PORT')
+        command = test_case.env.render(test_case.web.command)
+        args = [test_case.env.render(arg) for arg in test_case.web.args]
+        key = (command, tuple(args))
+        config = test_case.env.render(test_case.config)
+        config_hash = hashlib.sha1(config.encode()).hexdigest()
+
+        with self.lock:
+            service = self.services.pop(slot, None)
+        if service is not None:
+            if service.key == key and service.process.is_alive():
+                if service.config_hash == config_hash:
+                    self.put(slot, service)
+                    return service, self.REUSED
+                if self.reload_signal is not None and confirms_reload(test_case):
+                    self.reload(service, config, config_hash)
+                    self.put(slot, service)
+                    return service, self.RELOADED
+            self.stop(service)
+
+        cwd = self.workspaces.create(prefix='service_')
+        self.workspaces.write(cwd, 'api.yaml', config)
+        process = SupervisedProcess(command, args, cwd, log_path=os.path.join(cwd, 'web.log'))
+        service = Service(key, cwd, process, config_hash)
+        # Registered before it runs, so close() stops it whatever happens next
+        self.put(slot, service)
+        process.run()
+        return service, self.STARTED
+
+    def put(self, slot, service):
+        with self.lock:
+            self.services[slot] = service
+
+    def reload(self, service, config, config_hash):
+        """Write the new config and signal the service to reload it"""
+        self.workspaces.write(service.cwd, 'api.yaml', config)
+        # Log probes then only see what the service writes after the reload,
+        # the service appends to the log so truncating it is safe
+        os.truncate(os.path.join(service.cwd, 'web.log'), 0)
+        service.process.send_signal(self.reload_signal)
+        service.config_hash = config_hash
+
+    def discard(self, service):
+        """Stop a service that did not get ready, the next test case of its slot starts a new one"""
+        with self.lock:
+            for slot, pooled in list(self.services.items()):
+                if pooled is service:
+                    del self.services[slot]
+        self.stop(service, passed=False)
+
+    def stop(self, service, passed=True):
+        service.process.terminate()
+        self.workspaces.release(service.cwd, passed)
+
+    def close(self):
+        with self.lock:
+            services = list(self.services.values())
+            self.services.clear()
+        for service in services:
+            self.stop(service)
@@ -0,0 +1,39 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SessionPool(object):
+    """
+    Keep-alive HTTP sessions shared by the test cases of a run
+
+    requests.Session is not thread safe, so every worker thread gets its own
+    session; its connection pools are reused by every request the worker
+    sends to the same host.
+    """
+
+    def __init__(self, pool_size=10):
+        self.pool_size = pool_size
+        self.local = threading.local()
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.local.session = session
+            with self.lock:
+                self.sessions.append(session)
+        return session
+
+    def close(self):
+        with self.lock:
+            sessions = self.sessions
+            self.sessions = []
+        for session in sessions:
+            session.close()
+        self.local = threading.local()
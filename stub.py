@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import threading
+from aiohttp import web
+from base import RepeatedBody
+from compare import CHUNK_SIZE, expected_chunks
+
+NAMESPACE_PREFIX = '/_stub/'
+
+
+def routes_key(routes):
+    """Namespace of a list of routes, identical stub sections share one"""
+    digest = hashlib.sha1()
+    for route in routes:
+        digest.update(str(route).encode() + b'\n')
+    return digest.hexdigest()[:12]
+
+
+def body_length(body):
+    return len(body) if isinstance(body, RepeatedBody) else len(body.encode())
+
+
+class StubServer(object):
+    """
+    Local HTTP server answering with the responses declared by stub sections
+
+    It runs on its own asyncio event loop in a background thread, so both
+    engines share it, and is started once per run. The routes of every stub
+    section are served below their own namespace, /_stub/<key>, so test
+    cases declaring the same method and path with different responses do
+    not clash. Bodies are streamed from the (lazily generated) expected body.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.routes = {}  # (namespace, method, path) -> StubRoute
+        self.loop = None
+        self.runner = None
+        self.thread = None
+        self.error = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        started = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(started,), daemon=True)
+        self.thread.start()
+        started.wait()
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def run(self, started):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.serve())
+        except Exception as e:
+            self.error = e
+            started.set()
+            return
+        started.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.shutdown())
+        self.loop.close()
+
+    async def serve(self):
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port, backlog=1024)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+
+    async def shutdown(self):
+        await self.runner.cleanup()
+
+    def register(self, routes):
+        """
+        Serve a list of routes
+
+        Returns:
+            str: URL the paths of the routes are relative to
+        """
+        namespace = routes_key(routes)
+        for route in routes:
+            self.routes[(namespace, route.method, route.path)] = route
+        return f"{self.url}{NAMESPACE_PREFIX}{namespace}"
+
+    async def handle(self, request):
+        if not request.path.startswith(NAMESPACE_PREFIX):
+            return web.Response(status=404, text=f"not a stub path: {request.path}")
+        namespace, _, path = request.path[len(NAMESPACE_PREFIX):].partition('/')
+        route = self.routes.get((namespace, request.method, '/' + path))
+        if route is None:
+            return web.Response(status=404, text=f"no stub route for {request.method} /{path}")
+
+        await request.read()
+        if route.delay:
+            await asyncio.sleep(route.delay)
+
+        expected = route.response
+        response = web.StreamResponse(status=expected.status_code, headers=expected.headers)
+        if route.chunk_size:
+            response.enable_chunked_encoding()
+        else:
+            response.content_length = body_length(expected.body)
+        await response.prepare(request)
+        for chunk in expected_chunks(expected.body, route.chunk_size or CHUNK_SIZE):
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    def close(self):
+        if self.loop is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
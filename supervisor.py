@@ -0,0 +1,275 @@
+import asyncio
+import os
+import selectors
+import shutil
+import signal
+import subprocess
+import threading
+
+
+class RingBuffer(object):
+    """The last `size` bytes written to it"""
+
+    def __init__(self, size=65536):
+        self.size = size
+        self.data = bytearray()
+        self.lock = threading.Lock()
+
+    def write(self, chunk):
+        with self.lock:
+            self.data += chunk
+            if len(self.data) > self.size:
+                del self.data[:len(self.data) - self.size]
+
+    def getvalue(self):
+        with self.lock:
+            return bytes(self.data)
+
+    def tail(self, lines=5):
+        """Last lines as text, e.g. for an error message"""
+        text = self.getvalue().decode(errors='replace').rstrip('\n')
+        return '\n'.join(text.split('\n')[-lines:]) if text else ''
+
+
+class Reaper(object):
+    """
+    Reaps supervised children as soon as they exit
+
+    A single thread waits on the pidfds of all children (Linux 5.3+) and
+    collects their status and resource usage with wait4. Where pidfds are
+    not available every child gets a thread blocking in waitid instead.
+    Either way the child is only reaped once its exit was noticed, see
+    SupervisedProcess.collect.
+    """
+
+    def __init__(self):
+        self.selector = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.wakeup_r, self.wakeup_w = None, None
+
+    def watch(self, process):
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            threading.Thread(target=self.wait, args=(process,), daemon=True).start()
+            return
+
+        with self.lock:
+            if self.thread is None:
+                self.selector = selectors.DefaultSelector()
+                self.wakeup_r, self.wakeup_w = os.pipe()
+                self.selector.register(self.wakeup_r, selectors.EVENT_READ, None)
+                self.thread = threading.Thread(target=self.loop, daemon=True)
+                self.thread.start()
+            self.selector.register(pidfd, selectors.EVENT_READ, process)
+        # The selector only picks up new descriptors on its next call
+        os.write(self.wakeup_w, b'\0')
+
+    def loop(self):
+        while True:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    os.read(self.wakeup_r, 4096)
+                    continue
+                with self.lock:
+                    self.selector.unregister(key.fd)
+                os.close(key.fd)
+                # The pidfd is readable once the child exited, reaping it does not block
+                key.data.collect()
+
+    def wait(self, process):
+        """Block until the child exited, without reaping it"""
+        while True:
+            try:
+                os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+                break
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
+        process.collect()
+
+
+reaper = Reaper()
+
+
+class SupervisedProcess(object):
+    """
+    A child process running in its own session and process group
+
+    stdout and stderr are read into ring buffers of the last bytes written
+    and, when a log file is given, appended to it. The child is reaped as
+    soon as it exits, see Reaper, and its resource usage kept. terminate()
+    stops the whole process group: SIGTERM, then SIGKILL after stop_timeout.
+    Processes left in the group when the child exits are killed with it.
+    """
+
+    def __init__(self, command, args, cwd, log_path=None, buffer_size=65536, stop_timeout=5.0):
+        self.command = command
+        self.args = args
+        self.cwd = cwd
+        self.log_path = log_path  # File receiving stdout and stderr of the child
+        self.stop_timeout = stop_timeout
+        self.stdout = RingBuffer(buffer_size)
+        self.stderr = RingBuffer(buffer_size)
+        self.popen = None
+        self.pid = None
+        self.returncode = None
+        self.rusage = None
+        self.exited = threading.Event()
+        self.exit_callbacks = []
+        self.lock = threading.Lock()
+        self.readers = []
+
+    @property
+    def child_pid(self):
+        return self.pid
+
+    def run(self):
+        command = shutil.which(self.command) or self.command
+        self.popen = subprocess.Popen([command] + self.args, cwd=self.cwd, stdin=subprocess.DEVNULL,
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        self.pid = self.popen.pid
+        for pipe, buffer in ((self.popen.stdout, self.stdout), (self.popen.stderr, self.stderr)):
+            reader = threading.Thread(target=self.read, args=(pipe, buffer), daemon=True)
+            reader.start()
+            self.readers.append(reader)
+        reaper.watch(self)
+        return self.pid
+
+    def read(self, pipe, buffer):
+        log = open(self.log_path, 'ab', buffering=0) if self.log_path is not None else None
+        try:
+            for chunk in iter(lambda: pipe.read1(65536), b''):
+                buffer.write(chunk)
+                if log is not None:
+                    log.write(chunk)
+        finally:
+            pipe.close()
+            if log is not None:
+                log.close()
+
+    def collect(self):
+        """
+        Called by the reaper once the child exited: kill what it left
+        behind in its group, e.g. docker compose plugins, then reap it and
+        keep its wait4 status and rusage
+
+        Until the child is reaped its pid, and so the id of its group,
+        cannot be reused. Signals are only sent before, under the lock.
+        """
+        self.signal_group(signal.SIGKILL)
+        with self.lock:
+            while True:
+                try:
+                    _, status, rusage = os.wait4(self.pid, 0)
+                    break
+                except InterruptedError:
+                    continue
+                except ChildProcessError:
+                    status, rusage = None, None
+                    break
+            self.returncode = os.waitstatus_to_exitcode(status) if status is not None else -1
+            self.rusage = rusage
+            # The status is collected already, keep Popen from waiting for it
+            self.popen.returncode = self.returncode
+            self.exited.set()
+            callbacks, self.exit_callbacks = self.exit_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_exit(self, callback):
+        """Call callback() once the child was reaped, from the reaper thread or right away if it was already"""
+        with self.lock:
+            if not self.exited.is_set():
+                self.exit_callbacks.append(callback)
+                return
+        callback()
+
+    def signal_group(self, signum):
+        """Signal the process group of the child, unless it was reaped and the group id may belong to another"""
+        with self.lock:
+            if self.pid is None or self.exited.is_set():
+                return
+            try:
+                os.killpg(self.pid, signum)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def send_signal(self, signum):
+        """Signal the child only, e.g. to make it reload its config"""
+        with self.lock:
+            if self.pid is not None and not self.exited.is_set():
+                os.kill(self.pid, signum)
+
+    def terminate(self, timeout=None):
+        """Stop the process group, gracefully first, and wait until the child was reaped"""
+        if self.pid is None:
+            return
+        if not self.exited.is_set():
+            self.signal_group(signal.SIGTERM)
+            if not self.exited.wait(self.stop_timeout if timeout is None else timeout):
+                self.signal_group(signal.SIGKILL)
+                self.exited.wait()
+
+    async def wait_async(self):
+        """Wait until the child was reaped, on the event loop rather than in a thread"""
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+
+        def notify():
+            if not exited.done():
+                exited.set_result(None)
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(notify)
+            except RuntimeError:
+                pass  # The loop was closed meanwhile
+
+        self.on_exit(wake)
+        await exited
+
+    async def terminate_async(self, timeout=None):
+        """Asyncio flavour of terminate followed by join"""
+        if self.pid is None:
+            return
+        if not self.exited.is_set():
+            self.signal_group(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(self.wait_async(), self.stop_timeout if timeout is None else timeout)
+            except asyncio.TimeoutError:
+                self.signal_group(signal.SIGKILL)
+                await self.wait_async()
+        # The pipes close once the group is gone, the readers end right after
+        while any(reader.is_alive() for reader in self.readers):
+            await asyncio.sleep(0.01)
+
+    def join(self, timeout=None):
+        if self.pid is not None:
+            self.exited.wait(timeout)
+            for reader in self.readers:
+                reader.join(timeout)
+
+    def is_alive(self):
+        return self.pid is not None and not self.exited.is_set()
+
+    def usage(self):
+        """
+        Returns:
+            dict: CPU seconds and peak RSS of the child, None until it was reaped
+        """
+        if self.rusage is None:
+            return None
+        return {
+            'user_cpu': round(self.rusage.ru_utime, 6),
+            'system_cpu': round(self.rusage.ru_stime, 6),
+            'max_rss_kb': self.rusage.ru_maxrss,
+        }
+
+    def describe_exit(self):
+        """Exit status and the last lines of stderr, for error messages"""
+        message = f"exit status {self.returncode}"
+        tail = self.stderr.tail()
+        return f"{message}: {tail}" if tail else message
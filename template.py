@@ -0,0 +1,79 @@
+import functools
+import os
+import re
+
+
+# ${NAME}, ${NAME:-default} or the escape $${ which renders a literal ${
+PLACEHOLDER = re.compile(r'\$\$\{|\$\{([A-Za-z_][A-Za-z0-9_]*)(?::-([^}]*))?\}')
+
+
+class TemplateError(Exception):
+    pass
+
+
+class Template(object):
+    """
+    A string with ${VAR} placeholders, split once into segments
+
+    Literal text is kept as str segments and placeholders as (name, default)
+    tuples, so rendering is a single pass over the segments regardless of
+    how many variables the env defines.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.segments = []
+        position = 0
+        for match in PLACEHOLDER.finditer(source):
+            if match.start() > position:
+                self.segments.append(source[position:match.start()])
+            if match.group(1) is None:
+                self.segments.append('${')
+            else:
+                self.segments.append((match.group(1), match.group(2)))
+            position = match.end()
+        if position < len(source):
+            self.segments.append(source[position:])
+
+    def render(self, variables, environ=os.environ):
+        """
+        Substitute the placeholders
+
+        A placeholder is looked up in variables, then in the process
+        environment, then its default is used.
+
+        Args:
+            variables (dict): Variables of the test case
+            environ (dict): Fallback variables, the process environment by default
+
+        Returns:
+            str: Rendered content
+
+        Raises:
+            TemplateError: If a placeholder without default is not defined anywhere
+        """
+        parts = []
+        for segment in self.segments:
+            if isinstance(segment, str):
+                parts.append(segment)
+                continue
+            name, default = segment
+            value = variables.get(name)
+            if value is None:
+                value = environ.get(name, default)
+            if value is None:
+                raise TemplateError(f"undefined variable: {name}")
+            parts.append(value)
+        return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_template(source):
+    return Template(source)
+
+
+def render(source, variables, environ=os.environ):
+    """Render source with variables, compiling it at most once"""
+    if '$' not in source:
+        return source
+    return compile_template(source).render(variables, environ)
@@ -0,0 +1,56 @@
+from base import RepeatedBody
+from compare import CHUNK_SIZE, StreamComparator, expected_chunks
+from histogram import Histogram, bucket_bounds, bucket_index
+
+
+def compare(expected, chunks, chunk_size=CHUNK_SIZE):
+    comparator = StreamComparator(expected_chunks(expected, chunk_size))
+    for chunk in chunks:
+        if not comparator.feed(chunk):
+            break
+    return comparator.finish(), comparator
+
+
+def test_equal_bodies_whatever_the_chunking():
+    assert compare('hello world', [b'hello world'])[0] is None
+    assert compare('hello world', [b'h', b'ello wo', b'', b'rld'], chunk_size=4)[0] is None
+    assert compare(RepeatedBody('ab', 1000), [b'ab' * 300, b'ab' * 700])[0] is None
+
+
+def test_first_difference():
+    mismatch, comparator = compare('hello world', [b'hello', b' there'])
+    assert mismatch == 6
+    assert comparator.describe() == "body differs at byte 6: expected b'world', got b'there'"
+
+
+def test_length_differences():
+    assert compare('hello', [b'hello', b'!'])[0] == 5
+    mismatch, comparator = compare('hello', [b'hel'])
+    assert mismatch == 3
+    assert comparator.expected_excerpt == b'lo'
+
+
+def test_histogram_buckets_and_percentiles():
+    for value in (0, 127, 128, 1000, 123456789):
+        lowest, highest = bucket_bounds(bucket_index(value))
+        assert lowest <= value <= highest
+        # Within 1/64 above the exact range
+        assert highest - lowest <= max(0, value // 64)
+
+    histogram = Histogram()
+    for millisecond in range(1, 101):
+        histogram.record(millisecond / 1000)
+    assert histogram.count == 100
+    assert abs(histogram.percentile(50) - 0.050) <= 0.050 / 64
+    assert abs(histogram.percentile(99) - 0.099) <= 0.099 / 64
+    assert histogram.percentile(100) == 0.1
+
+
+def test_histogram_merge():
+    first, second = Histogram(), Histogram()
+    first.record(0.001)
+    second.record(0.003)
+    second.record(0.002)
+    first.merge(second)
+    assert (first.count, first.min, first.max) == (3, 1000, 3000)
+    assert first.mean() == 0.002
@@ -0,0 +1,47 @@
+from discovery import discover
+
+
+def write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def block(title):
+    return f"=== TEST {title}\n--- request\nGET /t\n\n"
+
+
+def make_tree(root):
+    write(root / 'users.t', block('1: create user @smoke') + block('2: delete user @slow'))
+    write(root / 'orders' / 'orders.t', block('1: list orders @smoke') + block('2: refund'))
+    write(root / 'orders' / 'notes.txt', block('1: not a test file'))
+    write(root / 'drafts' / 'wip.t', block('1: draft'))
+
+
+def selected(files):
+    return {(path.rsplit('/', 1)[1], index) for path, indexes in files.items() for index in indexes}
+
+
+def test_include_exclude_and_keywords(tmp_path):
+    make_tree(tmp_path)
+    files, total = discover(str(tmp_path), exclude=('drafts',))
+    assert total == 4
+    assert selected(files) == {('users.t', 0), ('users.t', 1), ('orders.t', 0), ('orders.t', 1)}
+
+    files, _ = discover(str(tmp_path), keywords=('@smoke',))
+    assert selected(files) == {('users.t', 0), ('orders.t', 0)}
+    files, _ = discover(str(tmp_path), keywords=('user', '!slow'))
+    assert selected(files) == {('users.t', 0)}
+
+
+def test_shards_split_every_block_once(tmp_path):
+    for number in range(20):
+        write(tmp_path / f"t{number:02}.t", block(f'1: first {number}') + block(f'2: second {number}'))
+    everything = selected(discover(str(tmp_path))[0])
+    shards = [selected(discover(str(tmp_path), shard=(index, 3))[0]) for index in range(3)]
+    assert set().union(*shards) == everything
+    assert sum(len(shard) for shard in shards) == len(everything) == 40
+    # Stable whatever the checkout path
+    other = tmp_path / 'copy'
+    for number in range(20):
+        write(other / f"t{number:02}.t", block(f'1: first {number}') + block(f'2: second {number}'))
+    assert selected(discover(str(other), shard=(1, 3))[0]) == shards[1]
@@ -0,0 +1,76 @@
+import io
+import pytest
+import async_engine
+import base
+import main
+from evaluate import RunContext, run_test
+from parser import parse_tests
+from report import Reporter
+from workspace import Workspaces
+
+
+class Collector(Reporter):
+    def __init__(self):
+        self.results = []
+
+    def add(self, result):
+        self.results.append(result)
+
+    def statuses(self):
+        return [(result.title, result.status) for result in self.results]
+
+
+def blocks(*sections):
+    return '\n'.join(f"=== TEST {number}: t{number}\n{section}" for number, section in enumerate(sections, 1))
+
+
+@pytest.fixture
+def context(tmp_path):
+    context = RunContext(workspaces=Workspaces(str(tmp_path / 'workspaces')), monitor_interval=None)
+    yield context
+    context.close()
+
+
+def run_engine(engine, tests, directory, prefix, context, maxfail=None):
+    reporter = Collector()
+    if engine == 'thread':
+        main.run_tests(tests, directory, prefix, context, 1, reporter, maxfail)
+    else:
+        async_engine.run_tests(tests, directory, prefix, context, 1, 1, reporter, maxfail)
+    return reporter
+
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_status_only_checks_reuse_the_connection(engine, tmp_path, upstream, context):
+    # Bodies are left unread by a status-only check unless they are drained
+    tests = parse_tests(io.StringIO(blocks(*["--- request\nGET /big\n--- response_body\nstatus 200\n"] * 5)))
+    reporter = run_engine(engine, tests, str(tmp_path), upstream.url, context)
+    assert [status for _, status in reporter.statuses()] == [base.TestResult.PASSED] * 5
+    assert upstream.requests == 5
+    assert upstream.connections == 1
+
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_single_request_is_rendered(engine, tmp_path, upstream, context):
+    tests = parse_tests(io.StringIO(blocks("--- env\nWHO=alice\n--- request\nGET /echo/${WHO}\n"
+                                           "--- response_body\nstatus 200\nbody ${WHO}\n")))
+    reporter = run_engine(engine, tests, str(tmp_path), upstream.url, context)
+    assert reporter.statuses() == [('1: t1', base.TestResult.PASSED)]
+
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_maxfail_skips_the_next_test_case(engine, tmp_path, context):
+    stubs = [f"--- stub\nGET /x {status}\nbody ok\n--- request\nGET /x\n--- response_body\nstatus 200\n"
+             for status in (200, 200, 500, 200)]
+    tests = parse_tests(io.StringIO(blocks(*stubs)))
+    reporter = run_engine(engine, tests, str(tmp_path), 'http://127.0.0.1:1', context, maxfail=1)
+    assert reporter.statuses() == [('1: t1', base.TestResult.PASSED), ('2: t2', base.TestResult.PASSED),
+                                   ('3: t3', base.TestResult.FAILED), ('4: t4', base.TestResult.SKIPPED)]
+    assert reporter.results[3].message == "not run, maxfail of 1 reached"
+
+
+def test_parse_error_is_reported(tmp_path, context):
+    test_case, = parse_tests(io.StringIO(blocks("--- timeout\ntest soon\n--- request\nGET /t\n")))
+    result = run_test(test_case, str(tmp_path), 'http://127.0.0.1:1', context)
+    assert result.status == base.TestResult.ERROR
+    assert result.message.startswith('invalid timeout section')
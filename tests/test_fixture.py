@@ -0,0 +1,90 @@
+import io
+import os
+import stat
+import pytest
+from fixture import FixtureCache, FixtureError
+from parser import parse_tests
+from workspace import Workspaces
+
+TESTS = """\
+=== TEST 1: db 1
+--- docker_compose_config
+services:
+  db:
+    image: mysql
+--- mysql_config
+[mysqld]
+--- init_sql
+CREATE TABLE a (id INT);
+
+=== TEST 2: db 2
+--- docker_compose_config
+services:
+  db:
+    image: mysql
+--- mysql_config
+[mysqld]
+--- init_sql
+CREATE TABLE b (id INT);
+"""
+
+# Stands in for docker: logs its arguments, keeps `compose up` running and
+# exits with $DOCKER_EXEC_STATUS on `compose exec`
+DOCKER = """\
+#!/bin/sh
+echo "$*" >> "$DOCKER_LOG"
+case "$2" in
+  up) exec sleep 60 ;;
+  exec) cat > /dev/null; exit "${DOCKER_EXEC_STATUS:-0}" ;;
+esac
+"""
+
+
+def write_script(path, content):
+    with open(path, 'w') as fp:
+        fp.write(content)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+@pytest.fixture
+def docker_log(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    write_script(bin_dir / 'docker', DOCKER)
+    write_script(bin_dir / 'mysqladmin', "#!/bin/sh\nexit 0\n")
+    log = tmp_path / 'docker.log'
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('DOCKER_LOG', str(log))
+    return log
+
+
+def docker_calls(log):
+    return [line.split(' ', 2)[1] for line in log.read_text().splitlines()]
+
+
+def test_same_stack_is_brought_up_once(tmp_path, docker_log):
+    workspaces = Workspaces(str(tmp_path / 'workspaces'))
+    fixtures = FixtureCache(workspaces, timeout=5.0)
+    first, second = parse_tests(io.StringIO(TESTS))
+    try:
+        fixture = fixtures.acquire(first, workspaces.create())
+        assert fixtures.acquire(second, workspaces.create()) is fixture
+        assert docker_calls(docker_log) == ['up', 'exec']
+    finally:
+        fixtures.close()
+        workspaces.close()
+    assert docker_calls(docker_log) == ['up', 'exec', 'down']
+
+
+def test_failed_init_sql_raises(tmp_path, docker_log, monkeypatch):
+    monkeypatch.setenv('DOCKER_EXEC_STATUS', '1')
+    workspaces = Workspaces(str(tmp_path / 'workspaces'))
+    fixtures = FixtureCache(workspaces, timeout=5.0)
+    first, second = parse_tests(io.StringIO(TESTS))
+    try:
+        fixtures.acquire(first, workspaces.create())
+        with pytest.raises(FixtureError, match='init_sql of 2: db 2 exited with 1'):
+            fixtures.acquire(second, workspaces.create())
+    finally:
+        fixtures.close()
+        workspaces.close()
@@ -0,0 +1,55 @@
+import base
+from evaluate import parse_tests_from_file
+from incremental import ResultsCache, select
+from report import Reporter
+
+TESTS = """\
+=== TEST 1: stable
+--- request
+GET /a
+
+=== TEST 2: flaky
+--- request
+GET /b
+
+=== TEST 3: new
+--- request
+GET /c
+"""
+
+
+class Collector(Reporter):
+    def __init__(self):
+        self.results = []
+
+    def add(self, result):
+        self.results.append(result)
+
+
+def run(path, cache_path, statuses, **options):
+    """Select the test cases of a file, record the given statuses and return the titles run and skipped"""
+    cache = ResultsCache(str(cache_path), 'http://127.0.0.1:${PORT}')
+    skipped = Collector()
+    run_titles = []
+    for test_case in select(parse_tests_from_file(str(path)), cache, skipped, **options):
+        run_titles.append(test_case.title)
+        cache.add(base.TestResult(test_case, statuses.get(test_case.title, base.TestResult.PASSED)))
+    cache.close()
+    return run_titles, [result.title for result in skipped.results]
+
+
+def test_changed_only_and_failed_first(tmp_path):
+    path = tmp_path / 'a.t'
+    path.write_text(TESTS)
+    cache_path = tmp_path / 'results.json'
+    assert run(path, cache_path, {'2: flaky': base.TestResult.FAILED}) == (['1: stable', '2: flaky', '3: new'], [])
+
+    # Only the failed test case runs again
+    assert run(path, cache_path, {}, changed_only=True) == (['2: flaky'], ['1: stable', '3: new'])
+
+    path.write_text(TESTS.replace('GET /c', 'GET /c?changed'))
+    assert run(path, cache_path, {}, changed_only=True) == (['3: new'], ['1: stable', '2: flaky'])
+
+    path.write_text(TESTS)
+    run(path, cache_path, {'3: new': base.TestResult.ERROR})
+    assert run(path, cache_path, {}, failed_first=True) == (['3: new', '1: stable', '2: flaky'], [])
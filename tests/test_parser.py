@@ -0,0 +1,95 @@
+import io
+import os
+from evaluate import parse_tests_from_file
+from parse_cache import ParseCache
+from parser import parse_tests
+
+TESTS = """\
+=== TEST 1: login @smoke
+--- env
+USER=alice
+--- request
+POST /login
+Content-Type: application/json
+
+{"name": "${USER}"}
+--- capture
+TOKEN = $.token
+--- request
+GET /me
+Authorization: Bearer ${TOKEN}
+--- response_body
+status 200
+body ${USER}
+
+=== TEST 2: bad timeout
+--- timeout
+test soon
+--- request
+GET /t
+"""
+
+
+def test_sections_and_steps():
+    login, bad = parse_tests(io.StringIO(TESTS))
+    assert login.title == '1: login'
+    assert login.tags == ['smoke']
+    assert login.env.env == {'USER': 'alice'}
+    assert login.has_steps
+    first, second = login.steps
+    assert (first.request.method, first.request.url) == ('POST', '/login')
+    assert first.request.headers == {'Content-Type': 'application/json'}
+    assert first.request.body == '{"name": "${USER}"}'
+    assert [capture.name for capture in first.captures] == ['TOKEN']
+    assert second.request.headers == {'Authorization': 'Bearer ${TOKEN}'}
+    assert (second.response.status_code, second.response.body) == (200, '${USER}')
+    # The first step is the request of the test case
+    assert login.request is first.request
+    assert login.parse_error is None
+    assert bad.parse_error.startswith('invalid timeout section')
+    assert bad.request.url == '/t'
+
+
+def write_tests(tmp_path, content=TESTS):
+    path = tmp_path / 'a.t'
+    path.write_text(content)
+    return str(path)
+
+
+def test_parse_cache_reuses_entry(tmp_path):
+    path = write_tests(tmp_path)
+    cache = ParseCache(str(tmp_path / 'cache'))
+    parsed = []
+
+    def parse_file(file_path):
+        parsed.append(file_path)
+        return parse_tests(io.StringIO(TESTS))
+
+    first = [test_case.title for test_case in cache.parse(path, parse_file)]
+    second = [test_case.title for test_case in cache.parse(path, parse_file)]
+    assert first == second == ['1: login', '2: bad timeout']
+    assert parsed == [path]
+
+
+def test_parse_cache_detects_changes(tmp_path):
+    path = write_tests(tmp_path)
+    cache = ParseCache(str(tmp_path / 'cache'))
+    list(parse_tests_from_file(path, cache))
+
+    # Touched only: the content hash still matches
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.open_entry(path) is not None
+
+    write_tests(tmp_path, TESTS.replace('bad timeout', 'renamed'))
+    assert cache.open_entry(path) is None
+    titles = [test_case.title for test_case in parse_tests_from_file(path, cache)]
+    assert titles == ['1: login', '2: renamed']
+
+
+def test_parse_cache_sets_file_and_index(tmp_path):
+    path = write_tests(tmp_path)
+    cache = ParseCache(str(tmp_path / 'cache'))
+    list(parse_tests_from_file(path, cache))
+    cached = list(parse_tests_from_file(path, cache))
+    assert [(test_case.file, test_case.index) for test_case in cached] == [(path, 0), (path, 1)]
@@ -0,0 +1,76 @@
+import socket
+import time
+import pytest
+import base
+from evaluate import RunContext, parse_tests_from_file, run_test
+from replay import ReplayServer, ReplayStore, request_key
+from workspace import Workspaces
+
+TESTS = """\
+=== TEST 1: echo
+--- request
+GET /echo/hello
+--- response_body
+status 200
+body hello
+
+=== TEST 2: big
+--- request
+GET /big
+--- response_body
+status 200
+body eval "x" x 1048576
+"""
+
+
+def run_file(path, directory, prefix, store, workspaces):
+    context = RunContext(workspaces=workspaces, monitor_interval=None, replay_store=store)
+    try:
+        return [run_test(test_case, directory, prefix, context) for test_case in parse_tests_from_file(path)]
+    finally:
+        context.close()
+
+
+@pytest.fixture
+def test_file(tmp_path):
+    path = tmp_path / 't' / 'a.t'
+    path.parent.mkdir()
+    path.write_text(TESTS)
+    return str(path)
+
+
+def test_replay_after_record(tmp_path, upstream, test_file):
+    store_dir = str(tmp_path / 'recorded')
+    workspaces = Workspaces(str(tmp_path / 'workspaces'))
+    results = run_file(test_file, str(tmp_path), upstream.url, ReplayStore(store_dir, recording=True), workspaces)
+    assert [result.status for result in results] == [base.TestResult.PASSED] * 2
+    assert upstream.requests == 2
+
+    # Nothing listens on the prefix any more, the store answers
+    results = run_file(test_file, str(tmp_path), 'http://127.0.0.1:1', ReplayStore(store_dir), workspaces)
+    assert [result.status for result in results] == [base.TestResult.PASSED] * 2
+    assert upstream.requests == 2
+
+
+def test_client_hanging_up_is_still_recorded(tmp_path, upstream):
+    store = ReplayStore(str(tmp_path / 'recorded'), recording=True)
+    server = ReplayServer(store).start()
+    try:
+        path = server.attach('a.t:0', upstream.url)[len(server.url):] + '/big'
+        with socket.create_connection(('127.0.0.1', server.port)) as sock:
+            sock.sendall(f"GET {path} HTTP/1.1\r\nHost: replay\r\n\r\n".encode())
+            assert sock.recv(12) == b'HTTP/1.1 200'
+        key = request_key('a.t:0', 'GET', '/big', b'')
+        for _ in range(100):
+            if store.get(key, 0) is not None:
+                break
+            time.sleep(0.02)
+    finally:
+        server.close()
+        store.close()
+    store = ReplayStore(str(tmp_path / 'recorded'))
+    try:
+        status, _, _, length = store.get(key, 0)
+    finally:
+        store.close()
+    assert (status, length) == (200, 1 << 20)
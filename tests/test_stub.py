@@ -0,0 +1,49 @@
+import io
+import requests
+from parser import parse_tests
+from stub import StubServer
+
+TESTS = """\
+=== TEST 1: user
+--- stub
+GET /users/1 200
+Content-Type: application/json
+body {"id": 1}
+
+POST /users 201
+body created
+
+=== TEST 2: same path, other response
+--- stub
+GET /users/1 404
+body missing
+
+=== TEST 3: big chunked
+--- stub
+GET /big
+chunked 1K
+body eval "ab" x 100000
+"""
+
+
+def test_routes_are_served_per_stub_section():
+    user, missing, big = parse_tests(io.StringIO(TESTS))
+    server = StubServer().start()
+    try:
+        user_url = server.register(user.stub)
+        missing_url = server.register(missing.stub)
+        assert user_url != missing_url
+
+        resp = requests.get(user_url + '/users/1')
+        assert (resp.status_code, resp.headers['Content-Type'], resp.text) == (200, 'application/json', '{"id": 1}')
+        resp = requests.post(user_url + '/users', data='{}')
+        assert (resp.status_code, resp.text) == (201, 'created')
+        resp = requests.get(missing_url + '/users/1')
+        assert (resp.status_code, resp.text) == (404, 'missing')
+        assert requests.get(user_url + '/unknown').status_code == 404
+
+        resp = requests.get(server.register(big.stub) + '/big')
+        assert resp.headers['Transfer-Encoding'] == 'chunked'
+        assert resp.content == b'ab' * 100000
+    finally:
+        server.close()
@@ -0,0 +1,22 @@
+import pytest
+from template import TemplateError, render
+
+
+def test_variables_environment_and_defaults():
+    variables = {'HOST': 'localhost'}
+    environ = {'PORT': '8080'}
+    assert render('http://${HOST}:${PORT}/', variables, environ) == 'http://localhost:8080/'
+    assert render('${USER:-nobody}', variables, environ) == 'nobody'
+    assert render('${EMPTY:-}', variables, environ) == ''
+    # The env of the test case wins over the process environment
+    assert render('${PORT}', {'PORT': '1'}, environ) == '1'
+
+
+def test_escape_and_plain_text():
+    assert render('$${HOST} costs $5', {'HOST': 'x'}, {}) == '${HOST} costs $5'
+    assert render('no placeholders', {}, {}) == 'no placeholders'
+
+
+def test_undefined_variable():
+    with pytest.raises(TemplateError, match='undefined variable: TOKEN'):
+        render('Bearer ${TOKEN}', {}, {})
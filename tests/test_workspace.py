@@ -0,0 +1,21 @@
+import pytest
+from workspace import DiskBudgetError, Workspaces, disk_usage
+
+
+def test_usage_is_kept_as_a_running_total(tmp_path):
+    workspaces = Workspaces(str(tmp_path), budget=64 * 1024, keep=Workspaces.KEEP_FAILED)
+    try:
+        passed, failed = workspaces.create(), workspaces.create()
+        for workspace in (passed, failed):
+            # Stored once, linked twice
+            workspaces.write(workspace, 'api.yaml', 'a' * 8000)
+        with open(f"{failed}/web.log", 'w') as fp:
+            fp.write('b' * 20000)
+        assert not workspaces.release(passed, True)
+        assert workspaces.release(failed, False)
+        assert workspaces.used == disk_usage(workspaces.run_dir)
+
+        with pytest.raises(DiskBudgetError, match='workspace budget of 64.0K exhausted'):
+            workspaces.write(workspaces.create(), 'big.yaml', 'c' * 40000)
+    finally:
+        workspaces.close()
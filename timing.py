@@ -0,0 +1,138 @@
+import asyncio
+import contextlib
+import cProfile
+import importlib
+import json
+import os
+import re
+import threading
+import time
+
+
+class Span(object):
+    """Wall time of one phase of a test case"""
+
+    def __init__(self, name, test_case, args):
+        self.name = name
+        self.test_case = test_case
+        self.args = args
+        self.lane = current_lane()
+        self.start = None
+        self.duration = None
+
+    def __str__(self):
+        title = self.test_case.title if self.test_case is not None else ''
+        return f"name: {self.name}, test: {title}, duration: {self.duration}"
+
+
+def current_lane():
+    """Thread, or asyncio task when inside one, a span is running on"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else threading.get_ident()
+
+
+class Tracer(object):
+    """
+    Records spans for the phases of every test case
+
+    The duration of each span is added to test_case.timings under the span
+    name. Hooks are called as hook(event, span) with event 'start' or 'end'
+    and let plugins observe every phase. Spans themselves are only kept
+    when a trace file is going to be written.
+    """
+
+    def __init__(self, keep_spans=False):
+        self.keep_spans = keep_spans
+        self.spans = []
+        self.hooks = []
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def load_plugin(self, name):
+        """Import a plugin module and let it register its hooks with register(tracer)"""
+        importlib.import_module(name).register(self)
+
+    @contextlib.contextmanager
+    def span(self, name, test_case=None, **args):
+        """
+        Time the enclosed block
+
+        Args:
+            name (str): Phase, e.g. parse, fixture, start, ready, request, validate, cleanup
+            test_case (TestCase): Test case the phase belongs to, may be set on the span later
+
+        Yields:
+            Span: The running span
+        """
+        span = Span(name, test_case, args)
+        for hook in self.hooks:
+            hook('start', span)
+        span.start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - span.start
+            if span.test_case is not None:
+                timings = span.test_case.timings
+                timings[name] = timings.get(name, 0.0) + span.duration
+            if self.keep_spans:
+                with self.lock:
+                    self.spans.append(span)
+            for hook in self.hooks:
+                hook('end', span)
+
+    def write_chrome_trace(self, path):
+        """Write the kept spans in the Chrome trace event format (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        lanes = {}
+        events = []
+        for span in self.spans:
+            # Small, stable thread ids keep the viewer readable
+            tid = lanes.setdefault(span.lane, len(lanes) + 1)
+            args = dict(span.args)
+            if span.test_case is not None:
+                args['test'] = span.test_case.title
+            events.append({
+                'name': span.name,
+                'cat': 'phase',
+                'ph': 'X',
+                'ts': round((span.start - self.origin) * 1000000, 3),
+                'dur': round(span.duration * 1000000, 3),
+                'pid': pid,
+                'tid': tid,
+                'args': args,
+            })
+        with open(path, 'w') as fp:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+
+
+@contextlib.contextmanager
+def profile(directory, test_case=None):
+    """Write a cProfile dump of the enclosed block to directory, if one is given, as run.prof without a test case"""
+    if directory is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active on this thread
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(directory, exist_ok=True)
+        if test_case is None:
+            name = 'run'
+        else:
+            name = re.sub(r'[^A-Za-z0-9_.-]+', '_', f"{os.path.basename(test_case.file or 'test')}_{test_case.index}_{test_case.title}")
+        profiler.dump_stats(os.path.join(directory, f"{name[:120]}.prof"))
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from monitor import format_size
+
+# tmpfs, the small files written per test case never reach a disk
+SHM_ROOT = '/dev/shm'
+
+
+def default_root():
+    """/dev/shm when it is writable, the temporary directory otherwise"""
+    if os.path.isdir(SHM_ROOT) and os.access(SHM_ROOT, os.W_OK | os.X_OK):
+        return SHM_ROOT
+    return tempfile.gettempdir()
+
+
+def allocated(path):
+    """Bytes allocated to a file"""
+    return os.lstat(path).st_blocks * 512
+
+
+def disk_usage(path, shared=True):
+    """
+    Bytes allocated below path, hard-linked files are counted once
+
+    Args:
+        shared (bool): Count files with several links too, e.g. those linked from the store
+    """
+    seen = set()
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(directory, name))
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) in seen or (not shared and stat.st_nlink > 1):
+                continue
+            seen.add((stat.st_dev, stat.st_ino))
+            total += stat.st_blocks * 512
+    return total
+
+
+class DiskBudgetError(OSError):
+    pass
+
+
+class Workspaces(object):
+    """
+    Directories the test cases of a run write their files and logs to
+
+    Every run gets its own directory below root, created on first use, and
+    every test case a workspace inside it. Files written through write()
+    are stored once per content in a store shared by the run and hard-linked
+    into the workspaces, read-only, so identical configs cost one inode. A
+    workspace is removed once its test case passed and kept otherwise, for
+    debugging, unless keep says differently. With a budget (bytes) no new
+    workspace or file is created once the run directory uses more.
+
+    The usage is a running total rather than measured every time: the store
+    and the copies made where links are not supported count as they are
+    written, the files a kept workspace holds once it is released.
+    """
+
+    KEEP_FAILED = 'failed'
+    KEEP_ALL = 'all'
+    KEEP_NONE = 'none'
+
+    def __init__(self, root=None, budget=None, keep=KEEP_FAILED):
+        self.root = root or default_root()
+        self.budget = budget
+        self.keep = keep
+        self.run_dir = None
+        self.kept = []
+        self.used = 0
+        self.copies = {}  # Workspace -> bytes of the files copied into it, counted in used
+        self.lock = threading.Lock()
+
+    @property
+    def store(self):
+        return os.path.join(self.run_dir, 'store')
+
+    def ensure_run_dir(self):
+        with self.lock:
+            if self.run_dir is None:
+                os.makedirs(self.root, exist_ok=True)
+                self.run_dir = tempfile.mkdtemp(prefix='api-test-', dir=os.path.abspath(self.root))
+                os.mkdir(self.store)
+        return self.run_dir
+
+    def check_budget(self, extra=0):
+        if self.budget is not None and self.used + extra > self.budget:
+            raise DiskBudgetError(f"workspace budget of {format_size(self.budget)} exhausted, "
+                                  f"{format_size(self.used)} used in {self.run_dir}")
+
+    def create(self, prefix='test_'):
+        """
+        Create an empty workspace
+
+        Returns:
+            str: Absolute path of the workspace
+        """
+        run_dir = self.ensure_run_dir()
+        with self.lock:
+            self.check_budget()
+        return tempfile.mkdtemp(prefix=prefix, dir=run_dir)
+
+    def write(self, workspace, name, content):
+        """
+        Place a file with the given content in a workspace
+
+        The file is a hard link to the copy in the store, a copy when the
+        file system does not support links. It is replaced, not rewritten,
+        when the workspace already has one of this name.
+
+        Returns:
+            str: Path of the file
+        """
+        data = content.encode()
+        stored = os.path.join(self.store, hashlib.sha1(data).hexdigest())
+        with self.lock:
+            if not os.path.exists(stored):
+                self.check_budget(len(data))
+                fd, temporary = tempfile.mkstemp(dir=self.store)
+                with os.fdopen(fd, 'wb') as fp:
+                    fp.write(data)
+                os.chmod(temporary, 0o444)
+                os.replace(temporary, stored)
+                self.used += allocated(stored)
+
+        path = os.path.join(workspace, name)
+        if os.path.lexists(path):
+            os.unlink(path)
+        try:
+            os.link(stored, path)
+        except OSError:
+            shutil.copyfile(stored, path)
+            size = allocated(path)
+            with self.lock:
+                self.used += size
+                self.copies[workspace] = self.copies.get(workspace, 0) + size
+        return path
+
+    def release(self, workspace, passed):
+        """
+        Remove the workspace of a finished test case, unless it is to be kept
+
+        Returns:
+            bool: Whether the workspace was kept
+        """
+        if self.keep == self.KEEP_ALL or (self.keep == self.KEEP_FAILED and not passed):
+            # Logs and whatever else the test case wrote stay, linked files are in the store already
+            usage = disk_usage(workspace, shared=False)
+            with self.lock:
+                self.used += usage - self.copies.pop(workspace, 0)
+                self.kept.append(workspace)
+            return True
+        shutil.rmtree(workspace, ignore_errors=True)
+        with self.lock:
+            self.used -= self.copies.pop(workspace, 0)
+        return False
+
+    def close(self):
+        """Remove the store, and the run directory unless workspaces were kept in it"""
+        if self.run_dir is None:
+            return
+        shutil.rmtree(self.store, ignore_errors=True)
+        if self.kept:
+            print(f"Kept {len(self.kept)} workspace(s) in {self.run_dir}")
+        else:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+        self.run_dir = None
+        self.used = 0
+        self.copies = {}